@@ -86,7 +86,7 @@ class Evolve(Manager):
         self.__audio_timing = self.register(AudioTiming([], [self.__audio_output]))
         # self.__transcription_generator = self.register(TranscriptionGenerator(self.__audio_input, 10.0))
         self.__chat_queues = self.register(ChatQueues())
-        self.__white_noise_generator = self.register(WhiteNoiseGenerator())
+        self.__white_noise_generator = self.register(WhiteNoiseGenerator(self.__audio_output))
         self.__server_manager = self.register(Server(self.__move_imp, self.__chat_queues, host, port))
         self.__cpu_temp_check = self.register(Cpu())
 
@@ -1,12 +1,13 @@
 # Internal libs
 from dynamics.task.interface.interface import Interface
 from peripherals.audio.output import Output, Audio
+from peripherals.audio.playback import Playback
 from gpt.client import Client
 from gpt.role import Role
 from gpt.message import Message
 
 # General utilities
-from datetime import datetime, timedelta
+from datetime import timedelta
 
 
 class Speak(Interface):
@@ -14,9 +15,14 @@ class Speak(Interface):
     Speak: Allows you to say something out loud
     """
 
+    TAG: str = "speak"
+
     __output: Output
     __client: Client
 
+    # The playback of the last reply, e.g. to wait for it or to cancel it when the user interrupts
+    playback: Playback | None = None
+
     def __init__(self, output: Output):
 
         super().__init__()
@@ -35,14 +41,26 @@ class Speak(Interface):
         """
 
         audio: Audio = self.__client.query_tts(text)
-        self.__output.play(audio)
-        time = datetime.now()
+        self.playback = self.__output.play(audio, tag=self.TAG)
+        self.playback.add_done_callback(self.__log_playback)
+
+        # Doesn't wait for the reply to be played, so that the dynamics can react to new input meanwhile. The times
+        # are an estimate from the recent queue latency of the output, the played times are logged once it is done.
+        latency: float = self.__output.queue_latency() or self.__output.target_latency
+        start = self.playback.queued + timedelta(seconds=latency)
         return Message(role=Role.USER,
                        content=text,
                        name="Shelly",
                        language=self.__client.language,
-                       timestamp_start=time,
-                       timestamp_end=time + timedelta(seconds=audio.seconds()))
+                       timestamp_start=start,
+                       timestamp_end=start + timedelta(seconds=audio.seconds()))
+
+    def __log_playback(self, playback: Playback) -> None:
+        if playback.cancelled:
+            self._logger.info(f"Reply was interrupted after {playback.seconds_played():.1f}s")
+        elif playback.started:
+            self._logger.debug(f"Reply was played from {playback.started:%H:%M:%S.%f} "
+                               f"to {playback.finished:%H:%M:%S.%f}")
 
 
 if __name__ == '__main__':
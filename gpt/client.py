@@ -1,6 +1,7 @@
 # External libs
 import openai
 from openai import OpenAI
+from soundfile import available_subtypes
 
 # Internal libs
 from gpt.conversation import Conversation
@@ -10,6 +11,7 @@ from gpt.voice import Voice
 from gpt.langauge import Language
 
 from peripherals.audio.audio import Audio
+from peripherals.audio.audio_stream import AudioStream
 
 from infra.resources_management.manager import Manager
 from infra.resources_management.manageable_wrapper import ManageableWrapper
@@ -26,6 +28,9 @@ class Client(Manager):
 
     __client: OpenAI = None
 
+    # Compressed upload format for whisper: opus if the installed libsndfile can write it, else lossless flac
+    WHISPER_ENCODING: str = "opus" if "OPUS" in available_subtypes("OGG") else "flac"
+
     temperature: float = None
     max_tokens: int = None
     language: Language = None
@@ -106,12 +111,18 @@ class Client(Manager):
             else:
                 raise err
 
-    def query_whisper(self, audio: Audio) -> str:
+    def query_whisper(self, audio: Audio | AudioStream) -> str:
+        """
+        :param audio: Compressed for the upload on the calling thread, streams chunk by chunk. Callers that must not
+                      block query from a worker thread, like the TranscriptionGenerator does.
+        """
+        stream: BytesIO = BytesIO(audio.encode(self.WHISPER_ENCODING))
 
         # Workaround because openai API reads the file type from the file handle name...
-        stream: BytesIO = audio.stream()
-        stream.name = "dummy.wav"
+        stream.name = f"dummy.{Audio.ENCODINGS[self.WHISPER_ENCODING][2]}"
+        return self.__query_whisper(stream)
 
+    def __query_whisper(self, stream: BytesIO) -> str:
         try:
             response = self.__client.audio.transcriptions.create(
                 model=Model.to_literal(Model.WHISPER__1),
@@ -123,10 +134,16 @@ class Client(Manager):
             return str(response)
         except openai.RateLimitError as err:
             self.__handle_rate_limit_error(err)
-            return self.query_whisper(audio)
+            stream.seek(0)
+            return self.__query_whisper(stream)
 
-    def query_tts(self, input_text: str, voice: Voice = Voice.ECHO):
+    def query_tts(self, input_text: str, voice: Voice = Voice.ECHO) -> Audio:
+        return self.stream_tts(input_text, voice).to_audio()
 
+    def stream_tts(self, input_text: str, voice: Voice = Voice.ECHO) -> AudioStream:
+        """
+        Source for text to speech: The reply is decoded one chunk at a time as it is consumed.
+        """
         try:
             response = self.__client.audio.speech.create(
                 model=Model.to_literal(Model.TTS__1),
@@ -141,10 +158,10 @@ class Client(Manager):
                 buffer.write(chunk)
             buffer.seek(0)
 
-            return Audio(ogg_buffer=buffer)
+            return AudioStream.from_ogg_buffer(buffer)
         except openai.RateLimitError as err:
             self.__handle_rate_limit_error(err)
-            return self.query_tts(input_text, voice)
+            return self.stream_tts(input_text, voice)
 
     def close(self) -> None:
         self.__client.close()
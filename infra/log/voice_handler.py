@@ -3,13 +3,14 @@ import logging
 
 from peripherals.audio.apps.espeak import ESpeak
 from peripherals.audio.enums.espeak_mode import EspeakMode
+from peripherals.audio.enums.output_channel import OutputChannel
 from peripherals.audio.audio import Audio
 from peripherals.audio.output import Output
+from peripherals.audio.playback import Playback
 
 from gpt.langauge import Language
 
 # General utilities
-from time import sleep
 from threading import Thread
 from logging import Handler, LogRecord
 
@@ -31,10 +32,10 @@ class VoiceHandler(Handler):
 
     def play(self, text: str) -> None:
         audio: Audio = self.__espeak.tts(text, self.language, self.mode)
-        self.__output.clear()
-        self.__output.play(audio)
+        self.__output.clear(OutputChannel.SPEECH)
+        playback: Playback = self.__output.play(audio)
         self.__output.start_playing()
-        sleep(audio.seconds())
+        playback.wait()
 
     def emit(self, record: LogRecord) -> None:
         # Do this in a separate thread since entering this method acquires a thread lock in the logging class
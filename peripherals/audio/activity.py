@@ -0,0 +1,52 @@
+# General utilities
+from threading import Condition
+from typing import List, Callable
+
+
+class Activity:
+    """
+    A published on/off state, e.g. whether an output is playing. Others can wait for changes or subscribe to them,
+    instead of polling.
+    """
+
+    __active: bool = None
+    __condition: Condition = None
+    __listeners: List[Callable[[bool], None]] = None
+
+    def __init__(self, active: bool = False):
+        self.__active = active
+        self.__condition = Condition()
+        self.__listeners = []
+
+    def is_active(self) -> bool:
+        with self.__condition:
+            return self.__active
+
+    def set(self, active: bool) -> None:
+        """
+        Changes the state, wakes up all waiting threads and calls all listeners if it actually changed
+        """
+        with self.__condition:
+            if active == self.__active:
+                return
+            self.__active = active
+            self.__condition.notify_all()
+            listeners: List[Callable[[bool], None]] = list(self.__listeners)
+
+        # Outside the lock, so that listeners can look at this activity again
+        for listener in listeners:
+            listener(active)
+
+    def subscribe(self, listener: Callable[[bool], None]) -> None:
+        """
+        :param listener: Called with the new state on every change, on the thread that changed it
+        """
+        with self.__condition:
+            self.__listeners.append(listener)
+
+    def wait_for(self, active: bool, timeout: float = None) -> bool:
+        """
+        :return: True once the state equals active, False if the timeout expired before
+        """
+        with self.__condition:
+            return self.__condition.wait_for(lambda: self.__active == active, timeout)
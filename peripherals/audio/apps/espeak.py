@@ -39,6 +39,7 @@ class ESpeak:
         assert proc.returncode == 0
 
         audio = Audio(wav_filename=tmp_wav_path)
+        audio.load()
 
         remove(tmp_txt_path)
         remove(tmp_wav_path)
@@ -1,6 +1,7 @@
 # Internal libs
 from peripherals.audio.audio import Audio
 from peripherals.audio.input import Input
+from peripherals.audio.speech_preprocessor import SpeechPreprocessor
 
 from gpt.client import Client
 from gpt.message import Message
@@ -10,14 +11,34 @@ from gpt.langauge import Language
 from infra.resources_management.threaded_app import ThreadedApp
 
 # General utilities
+from concurrent.futures import ThreadPoolExecutor, Future
 from datetime import datetime, timedelta
-from queue import Queue, Empty
+from itertools import count
+from queue import Queue, Empty, Full
+from typing import List, Dict, Iterator
 
 
 class TranscriptionGenerator(ThreadedApp):
+    """
+    Transcribes the utterances of an input into user messages.
+
+    Every captured segment is uploaded and transcribed exactly once, as soon as it arrives, on a small thread pool, so
+    that transcription overlaps with the recording of the next segment. The transcripts are kept per segment id and
+    stitched together in order once the user stops speaking.
+    """
+
+    MAX_CONCURRENT_QUERIES: int = 4
 
     __input: Input = None
     __client: Client = None
+    __preprocessor: SpeechPreprocessor = None
+    __transcriber: ThreadPoolExecutor = None
+
+    # Transcripts of the segments of the current utterance by segment id, and the start and end of the utterance
+    __transcripts: Dict[int, Future] = None
+    __segment_ids: Iterator[int] = None
+    __utterance_start: datetime | None = None
+    __utterance_end: datetime | None = None
 
     recording_time: float = None
 
@@ -37,49 +58,80 @@ class TranscriptionGenerator(ThreadedApp):
 
         self.__input = input_loop
         self.__client = Client(0.5)
+        self.__preprocessor = SpeechPreprocessor()
+        self.__transcriber = ThreadPoolExecutor(max_workers=self.MAX_CONCURRENT_QUERIES,
+                                                thread_name_prefix="Thread 'transcriber'")
+
+        self.__transcripts = {}
+        self.__segment_ids = count()
 
-        self.__audios_queue = Queue()
         self.queue = Queue()
         self.__queue_timeout: float = queue_timeout
 
         self._make_thread(self.__transcription_loop)
 
+    def __transcribe(self, segment_id: int, audio: Audio) -> str:
+        speech: Audio = self.__preprocessor(audio)
+        if not speech.frames():
+            self._logger.debug(f"Segment {segment_id} contains no speech")
+            return ""
+        return self.__client.query_whisper(speech).strip()
+
+    def __add_segment(self, timestamp: datetime, audio: Audio) -> None:
+        segment_id: int = next(self.__segment_ids)
+        self.__transcripts[segment_id] = self.__transcriber.submit(self.__transcribe, segment_id, audio)
+        if self.__utterance_start is None:
+            self.__utterance_start = timestamp
+        self.__utterance_end = timestamp + timedelta(seconds=audio.seconds())
+
+    def __finish_utterance(self) -> None:
+        """
+        Stitches the transcripts of all segments of the utterance in order, and queues them as one message
+        """
+        transcripts: List[str] = []
+        for segment_id in sorted(self.__transcripts):
+            try:
+                transcripts.append(self.__transcripts[segment_id].result())
+            except Exception:
+                self._logger.exception(f"Could not transcribe segment {segment_id}")
+        transcription_text: str = " ".join(transcript for transcript in transcripts if transcript)
+
+        message: Message = Message(role=Role.USER,
+                                   content=transcription_text,
+                                   language=self.language,
+                                   timestamp_start=self.__utterance_start,
+                                   timestamp_end=self.__utterance_end)
+        self.__transcripts.clear()
+        self.__utterance_start = self.__utterance_end = None
+
+        if not transcription_text:
+            self._logger.debug("Discarded utterance without speech")
+            return
+
+        try:
+            self.queue.put(message, timeout=self.__queue_timeout)
+            self._logger.info(f"Transcribed: {message.content}")
+        except Full:
+            self._logger.exception("Could not put transcription into queue (queue is unexpectedly blocked)")
+
     def __transcription_loop(self) -> None:
-        audio: Audio | None = None
         while not self.was_closed:
-            timestamp: datetime | None = None
             try:
-                new_audio: Audio | None
-                timestamp, new_audio = self.__input.queue.get(timeout=self.__queue_timeout)
+                timestamp: datetime
+                audio: Audio
+                timestamp, audio = self.__input.queue.get(timeout=self.__queue_timeout)
+                # TODO: Recognise and add name
+                self.__add_segment(timestamp, audio)
             except Empty:
-                new_audio = None
+                pass
 
-            if audio and new_audio:
-                audio += new_audio
-            elif new_audio:
-                audio = new_audio
-            else:
-                continue
+            # The utterance ends once the user stopped speaking and all of its segments arrived
+            if self.__transcripts and not self.__input.is_recording() and self.__input.queue.empty():
+                self.__finish_utterance()
 
-            # TODO: Recognise and add name
-            # TODO: Stitch audios together with a pause
-            transcription_text: str = self.__client.query_whisper(audio)
-
-            if self.__input.is_recording():
-                # Discard transcription and keep listening
-                continue
-
-            message: Message = Message(role=Role.USER,
-                                       content=transcription_text,
-                                       language=self.language,
-                                       timestamp_start=timestamp,
-                                       timestamp_end=timestamp+timedelta(seconds=audio.seconds()))
-
-            try:
-                self.queue.put(message, timeout=self.__queue_timeout)
-                self._logger.info(f"Transcribed: {message.content}")
-            except Empty:
-                self._logger.exception("Could not put transcription into queue (queue is unexpectedly blocked)")
+    def close(self) -> None:
+        super().close()
+        self.__transcriber.shutdown(cancel_futures=True)
 
 
 if __name__ == '__main__':
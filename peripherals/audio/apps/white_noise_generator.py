@@ -1,45 +1,56 @@
 # External libs
 
 # Internal libs
+from peripherals.audio.audio_stream import AudioStream
+from peripherals.audio.chunk import Chunk
+from peripherals.audio.conversion import Conversion
+from peripherals.audio.enums.output_channel import OutputChannel
 from peripherals.audio.output import Output, Audio
 
 from infra.resources_management.threaded_app import ThreadedApp
 
 # General utilities
-from time import sleep
 from os.path import join, pardir, dirname, realpath
+from typing import Iterator
 
 
 class WhiteNoiseGenerator(ThreadedApp):
+    """
+    Loops white noise seamlessly on the noise channel of a shared output, where it is ducked under speech
+    """
 
     __output: Output = None
     __audio: Audio = None
 
-    def __init__(self):
+    def __init__(self, output: Output):
 
         super().__init__()
 
-        self.__output = Output()
+        self.__output = output
 
         self._logger.debug("Setting directories..")
         directory: str = dirname(realpath(__file__))
         wav_path: str = realpath(join(directory, pardir, pardir, pardir, "files", "other", "whitenoise.wav"))
         self.__audio = Audio(wav_filename=wav_path)
+        # Converted once, so that the loop is played without any further conversion
+        self.__audio.to_device_format(Conversion.WORKING_SAMPLE_WIDTH, True, output.channels, output.frame_rate)
 
-        self._make_thread(self.__white_noise)
-
-    def __white_noise(self) -> None:
+    def __white_noise(self) -> Iterator[Chunk]:
         while not self.was_closed:
-            self.__output.play(self.__audio.copy())
-            sleep(self.__audio.seconds())
+            yield from self.__audio.iter_chunks()
 
     def start(self) -> None:
         super().start()
-        self.__output.start()
+        self.__output.play(AudioStream(self.__white_noise(),
+                                       self.__audio.channels,
+                                       self.__audio.frame_rate,
+                                       self.__audio.sample_width,
+                                       self.__audio.using_float),
+                           channel=OutputChannel.NOISE)
 
     def close(self) -> None:
         super().close()
-        self.__output.close()
+        self.__output.clear(OutputChannel.NOISE)
 
 
 if __name__ == '__main__':
@@ -47,6 +58,6 @@ if __name__ == '__main__':
     LoggingSetup(override_level=LoggingSetup.DEBUG)
 
     from time import sleep
-    with WhiteNoiseGenerator() as wng:
-        wng.start()
-        sleep(3.0)
+    with Output() as out:
+        with WhiteNoiseGenerator(out) as wng:
+            sleep(3.0)
@@ -1,22 +1,35 @@
 # External libs
 import wave
+import numpy as np
 from numpy import ndarray
-from soundfile import SoundFile
+from soundfile import SoundFile, write as sound_file_write
+from scipy.signal import resample_poly
 
 # Internal libs
 from peripherals.audio.chunk import Chunk
+from peripherals.audio.statistics import Statistics
+from peripherals.audio.shared_buffer import SharedBuffer
+from peripherals.audio.wav_file import WavFile
+from peripherals.audio.conversion import Conversion
 
 from infra.log.loggable import Loggable
 
 # General other
 from io import BytesIO
-from copy import deepcopy
-from typing import Tuple, List, Any
+from fractions import Fraction
+from typing import List, Dict, Tuple, Any, Iterator
 
 
 class Audio(Loggable):
     """
     A generic representation of and audio object that supports cutting and format conversions - to some extent.
+
+    All samples live in one contiguous, growable numpy buffer (interleaved if there are several channels). Only the
+    section between _start and _stop is valid, the rest is spare capacity. Chunks are handed out as zero-copy views
+    of that buffer, so re-chunking is free.
+
+    The buffer is shared copy-on-write: copies, slices, popped chunks and chunk views all look at the same memory until
+    one of the owners writes to it, which then copies its own section first.
     """
 
     sample_width: int = None
@@ -24,7 +37,21 @@ class Audio(Loggable):
     frame_rate: int = None
     using_float: bool = None
 
-    chunks: List[Chunk] = None
+    chunk_size: int = None
+
+    _storage: SharedBuffer = None
+    _start: int = None
+    _stop: int = None
+
+    _statistics: Statistics = None
+    _encodings: Dict[str, bytes] = None
+
+    # soundfile (format, subtype) and file extension of the supported encodings, wav is the default
+    ENCODINGS: Dict[str, Tuple[str, str, str]] = {"wav": ("WAV", "PCM_16", "wav"),
+                                                  "flac": ("FLAC", "PCM_16", "flac"),
+                                                  "ogg": ("OGG", "VORBIS", "ogg"),
+                                                  "opus": ("OGG", "OPUS", "ogg")}
+    OPUS_FRAME_RATES: List[int] = [8000, 12000, 16000, 24000, 48000]
 
     DEFAULT_CHUNK_SIZE = 1024
     DEFAULT_FRAME_RATE = 44100
@@ -34,205 +61,421 @@ class Audio(Loggable):
     def _using_float_convention(sample_width: int):
         return sample_width > 2
 
+    @property
+    def d_type(self) -> np.dtype:
+        return np.dtype(f"{'f' if self.using_float else 'i'}{self.sample_width}")
+
+    @property
+    def _buffer(self) -> ndarray:
+        return self._storage.array
+
+    @property
+    def chunks(self) -> List[Chunk]:
+        """
+        Zero-copy views of the buffer, each holding chunk_size frames (the last one may be shorter).
+        The views are read-only, any change has to go through the Audio object.
+        """
+        return list(self.iter_chunks())
+
+    def iter_chunks(self) -> Iterator[Chunk]:
+        """
+        Lazy version of chunks. Changing the audio while iterating does not affect the chunks still to come.
+        """
+        storage: SharedBuffer = self._storage.share()
+        try:
+            step: int = self.chunk_size * self.channels
+            stop: int = self._stop
+            for start in range(self._start, stop, step):
+                view: ndarray = storage.array[start:min(start + step, stop)]
+                view.flags.writeable = False
+                yield Chunk(nparray=view, storage=storage)
+        finally:
+            storage.release()
+
+    def number_of_chunks(self) -> int:
+        return -(-self.frames() // self.chunk_size)
+
+    def nparray(self) -> ndarray:
+        """
+        :return: A read-only view of all valid samples. It does not change with the audio, which copies its buffer
+                 before the next change.
+        """
+        self._storage.export()
+        view: ndarray = self._buffer[self._start:self._stop]
+        view.flags.writeable = False
+        return view
+
+    def __samples(self) -> ndarray:
+        """
+        :return: A writable view of all valid samples, only to be written to after __reserve and not to be handed out
+        """
+        return self._buffer[self._start:self._stop]
+
+    @staticmethod
+    def __immutable(samples: ndarray) -> bool:
+        """
+        :return: Whether nobody can change the samples anymore, because they are a view of e.g. bytes or a read-only mmap
+        """
+        base: Any = samples
+        while isinstance(base, ndarray) and base.base is not None:
+            base = base.base
+        if isinstance(base, ndarray):
+            return False
+        try:
+            return memoryview(base).readonly
+        except TypeError:
+            return False
+
     def normalise_chunks(self, chunk_size: int) -> None:
-        new_chunks: List[Chunk] = []
-        target_frames = chunk_size
-        for chunk in self.chunks:
-            remaining = chunk
-            while remaining.frames() > 0:
-                new_chunk, remaining = remaining.split(target_frames)
-                if target_frames < chunk_size:
-                    new_chunks[-1].append(new_chunk)
-                    target_frames = chunk_size - new_chunks[-1].frames()
-                    if target_frames == 0:
-                        target_frames = chunk_size
-                else:
-                    new_chunks.append(new_chunk)
-
-        self.chunks = new_chunks
+        if chunk_size != self.chunk_size:
+            self.chunk_size = chunk_size
+            self._changed()
+
+    def _changed(self) -> None:
+        """
+        Has to be called whenever the samples or their chunking change, to invalidate everything derived from them
+        """
+        self._statistics = None
+        self._encodings = {}
+
+    def statistics(self) -> Statistics:
+        """
+        :return: Per-chunk signal statistics, cached until the audio changes
+        """
+        if self._statistics is None:
+            self._statistics = Statistics(self.__samples(), self.chunk_size * self.channels, self.channels)
+        return self._statistics
 
     def extend_zeros(self, chunk_size: int, target_number_of_chunks: int):
-        self.chunks[-1].fill_with_zeros(chunk_size)
-        missing_chunks = target_number_of_chunks - len(self.chunks)
-        for i in range(max(missing_chunks, 0)):
-            self.chunks.append(Chunk.zeros(chunk_size, self.sample_width, self.using_float))
-
-    def __init_from_wav_filename(self, filename: str, chunk_size: int) -> None:
-        with wave.open(filename, "rb") as wf:
-            self.channels = wf.getnchannels()
-            self.frame_rate = wf.getframerate()
-            self.sample_width = wf.getsampwidth()
-            self.using_float = self._using_float_convention(self.sample_width)
-            self.chunks = []
-            while len(data := wf.readframes(chunk_size or self.DEFAULT_CHUNK_SIZE)):
-                chunk = Chunk(raw_bytes=data,
-                              sample_width=self.sample_width,
-                              using_float=self.using_float)
-                self.chunks.append(chunk)
-
-    def __init_from_wav_buffer(self, buffer: BytesIO, chunk_size: int) -> None:
-        with wave.open(buffer, "rb") as wf:
-            self.channels = wf.getnchannels()
-            self.frame_rate = wf.getframerate()
-            self.sample_width = wf.getsampwidth()
-            self.using_float = self._using_float_convention(self.sample_width)
-            self.chunks = []
-            while len(data := wf.readframes(chunk_size or self.DEFAULT_CHUNK_SIZE)):
-                chunk = Chunk(raw_bytes=data,
-                              sample_width=self.sample_width,
-                              using_float=self.using_float)
-                self.chunks.append(chunk)
+        missing_samples: int = chunk_size * target_number_of_chunks * self.channels - (self._stop - self._start)
+        missing_samples = max(missing_samples, (-(self._stop - self._start)) % (chunk_size * self.channels))
+        if missing_samples > 0:
+            self.__reserve(missing_samples)
+            self._buffer[self._stop:self._stop + missing_samples] = 0
+            self._stop += missing_samples
+            self._changed()
+
+    def __set_storage(self, storage: SharedBuffer, start: int, stop: int) -> None:
+        storage.share()
+        if self._storage is not None:
+            self._storage.release()
+        self._storage = storage
+        self._start = start
+        self._stop = stop
+        self._changed()
+
+    def __adopt(self, samples: ndarray) -> None:
+        """
+        Makes the given 1-d array the new buffer, without copying it. The audio takes ownership of the array.
+        """
+        self.__set_storage(SharedBuffer(samples), 0, len(samples))
+
+    def __reserve(self, extra_samples: int) -> None:
+        """
+        Makes sure there is writable capacity for extra_samples behind _stop. This is where copy-on-write happens:
+        If the buffer is shared or read-only, the valid section is copied into a buffer of our own first.
+        Growing is geometric, so that appending is amortised O(1).
+        """
+        required: int = self._stop + extra_samples
+        if self._storage.writable and required <= len(self._buffer):
+            return
+
+        used: int = self._stop - self._start
+        if self._storage.writable:
+            capacity: int = max(2 * (used + extra_samples), self.chunk_size * self.channels)
+        else:
+            capacity: int = used + extra_samples
+        buffer: ndarray = np.empty(capacity, dtype=self._buffer.dtype)
+        buffer[:used] = self._buffer[self._start:self._stop]
+        self.__set_storage(SharedBuffer(buffer), 0, used)
+
+    def __init_from_wav(self, wav_file: WavFile) -> None:
+        self.channels = wav_file.channels
+        self.frame_rate = wav_file.frame_rate
+        self.sample_width = wav_file.sample_width
+        self.using_float = wav_file.using_float
+        self.__adopt(wav_file.samples)
 
     def __init_from_chunks(self, chunks: List[Chunk],
                            channels: int,
                            frame_rate: int,
                            sample_width: int,
-                           max_chunk_size: int) -> None:
-        assert chunks
-        self.chunks = chunks
+                           using_float: bool) -> None:
         assert channels
         self.channels = channels
         assert frame_rate
         self.frame_rate = frame_rate
         assert sample_width
         self.sample_width = sample_width
-        self.using_float = self._using_float_convention(sample_width)
-
-        if max_chunk_size is not None:
-            self.normalise_chunks(max_chunk_size)
+        self.using_float = using_float
+
+        storage: SharedBuffer | None = chunks[0].storage() if len(chunks) == 1 else None
+        if storage is not None and chunks[0].nparray().dtype == self.d_type:
+            # Keep sharing the buffer the chunk is a view of
+            view: ndarray = chunks[0].nparray()
+            start: int = (view.ctypes.data - storage.array.ctypes.data) // view.itemsize
+            self.__set_storage(storage, start, start + len(view))
+        elif len(chunks) == 1 and chunks[0].nparray().dtype == self.d_type:
+            # Unless nobody can change the array anymore, the caller could still write to it
+            samples: ndarray = chunks[0].nparray()
+            self.__adopt(samples if self.__immutable(samples) else samples.copy())
+        elif chunks:
+            self.__adopt(np.concatenate([chunk.nparray() for chunk in chunks], dtype=self.d_type, casting="unsafe"))
+        else:
+            self.__adopt(np.empty(0, dtype=self.d_type))
 
-    def __init_from_ogg_buffer(self, buffer: BytesIO, chunk_size: int):
+    def __init_from_ogg_buffer(self, buffer: BytesIO):
         with SoundFile(buffer, 'r') as sound_file:
             self.channels = sound_file.channels
             self.frame_rate = sound_file.samplerate
             self.sample_width = 2
             self.using_float = False
-            self.chunks = []
-            data = sound_file.read(chunk_size or self.DEFAULT_CHUNK_SIZE, dtype='int16')
-            while len(data) > 0:
-                chunk = Chunk(raw_bytes=data.tobytes(),
-                              sample_width=2,
-                              using_float=False)
-                self.chunks.append(chunk)
-                data = sound_file.read(chunk_size or self.DEFAULT_CHUNK_SIZE, dtype='int16')
+            self.__adopt(sound_file.read(dtype='int16').reshape(-1))
 
     def __init__(self, chunks: List[Chunk] | List[ndarray] | Chunk | ndarray = None, byte_chunks: List[bytes] = None,
                  channels: int = None, frame_rate: int = None, sample_width: int = None, ogg_buffer: BytesIO = None,
                  wav_buffer: BytesIO = None, chunk_size: int = None, wav_filename: str = None):
 
         super().__init__()
-        
+
         if wav_filename is not None:
             assert not (chunks or byte_chunks or channels or frame_rate or sample_width)
             assert ogg_buffer is None
             assert wav_buffer is None
-            self.__init_from_wav_filename(wav_filename, chunk_size)
+            self.__init_from_wav(WavFile(wav_filename))
         elif wav_buffer is not None:
             assert not (chunks or byte_chunks or channels or frame_rate or sample_width)
             assert ogg_buffer is None
-            self.__init_from_wav_buffer(wav_buffer, chunk_size)
+            self.__init_from_wav(WavFile(data=wav_buffer.getvalue()))
         elif ogg_buffer is not None:
             assert (not (chunks or byte_chunks or channels or frame_rate or sample_width))
-            self.__init_from_ogg_buffer(ogg_buffer, chunk_size)
+            self.__init_from_ogg_buffer(ogg_buffer)
         elif byte_chunks is not None:
             assert chunks is None
             using_float = self._using_float_convention(sample_width)
             parsed_chunks = [Chunk(byte_chunk, sample_width, using_float) for byte_chunk in byte_chunks]
-            self.__init_from_chunks(parsed_chunks, channels, frame_rate, sample_width, chunk_size)
+            self.__init_from_chunks(parsed_chunks, channels, frame_rate, sample_width, using_float)
         else:
             if not isinstance(chunks, list):
                 chunks = [chunks]
             if chunks and isinstance(chunks[0], ndarray):
                 chunks = [Chunk(nparray=chunk) for chunk in chunks]
+            if sample_width is None:
+                assert chunks
+                using_float = chunks[0].using_float()
+                sample_width = chunks[0].sample_width()
+            else:
+                using_float = self._using_float_convention(sample_width)
+            if chunk_size is None and chunks and chunks[0].frames():
+                chunk_size = chunks[0].frames() // (channels or self.DEFAULT_CHANNELS)
             self.__init_from_chunks(chunks,
                                     channels or self.DEFAULT_CHANNELS,
                                     frame_rate or self.DEFAULT_FRAME_RATE,
-                                    sample_width or chunks[0].sample_width(),
-                                    chunk_size)
+                                    sample_width,
+                                    using_float)
+
+        self.chunk_size = chunk_size or self.DEFAULT_CHUNK_SIZE
+
+    def __write(self, target: BytesIO | str, encoding: str = "wav") -> None:
+        if encoding == "opus" and self.frame_rate not in self.OPUS_FRAME_RATES:
+            # Opus only supports a few frame rates
+            resampled: Audio = self.copy()
+            resampled.resample(min((rate for rate in self.OPUS_FRAME_RATES if rate >= self.frame_rate), default=48000))
+            resampled.__write(target, encoding)
+            return
+
+        samples: ndarray = self.__samples()
+        sample_width: int = self.sample_width
+        if self.using_float:
+            # Files are a boundary of the float working format
+            samples = Conversion.convert(samples, np.dtype(np.int16))
+            sample_width = 2
+
+        if encoding != "wav":
+            sound_format, subtype, _ = self.ENCODINGS[encoding]
+            sound_file_write(target, samples.reshape(-1, self.channels), self.frame_rate,
+                             format=sound_format, subtype=subtype)
+            return
 
-    def __write(self, target: BytesIO | str) -> None:
         with wave.open(target, "wb") as wf:
             wf.setnchannels(self.channels)
-            wf.setsampwidth(self.sample_width)
+            wf.setsampwidth(sample_width)
             wf.setframerate(self.frame_rate)
-            wf.writeframes(b''.join([chunk.tobytes() for chunk in self.chunks]))
+            wf.writeframes(samples)
+
+    def load(self) -> None:
+        """
+        Audio loaded from a wav file is memory-mapped and read lazily. This copies the samples into memory, e.g. so that
+        the file can be deleted.
+        """
+        self.__reserve(0)
+
+    def __del__(self):
+        if self._storage is not None:
+            self._storage.release()
+
+    def __from_samples(self, samples: ndarray, chunk_size: int = None) -> Any:
+        """
+        :param samples: Taken over without copying, so nobody else may write to them anymore
+        :return: An audio object in the format of this one
+        """
+        res: Audio = Audio(chunks=samples[:0],
+                           channels=self.channels,
+                           frame_rate=self.frame_rate,
+                           sample_width=self.sample_width,
+                           chunk_size=chunk_size or self.chunk_size)
+        res.__adopt(samples)
+        return res
+
+    def __view(self, start: int, stop: int) -> Any:
+        """
+        :return: An audio object sharing the section [start, stop) (relative to _start) of the buffer, without copying
+        """
+        res: Audio = self.__from_samples(self.__samples()[start:stop])
+        res.__set_storage(self._storage, self._start + start, self._start + stop)
+        return res
 
     def pop(self, index: int = 0):
-        if not self.chunks:
+        """
+        Removes one chunk and returns it as an Audio object. Popping the first chunk is O(1) and does not copy.
+        """
+        number_of_chunks: int = self.number_of_chunks()
+        if not number_of_chunks:
             return None
-        chunk: Chunk = self.chunks.pop(index)
-        return Audio(chunks=chunk,
-                     channels=self.channels,
-                     frame_rate=self.frame_rate,
-                     sample_width=self.sample_width,
-                     chunk_size=chunk.frames())
-
-    def stream(self) -> BytesIO:
-        buffer = BytesIO()
-        self.__write(buffer)
-        buffer.seek(0)
-        return buffer
-
-    def save(self, filename: str) -> None:
-        self.__write(filename)
+        index %= number_of_chunks
+
+        step: int = self.chunk_size * self.channels
+        start: int = index * step
+        stop: int = min(start + step, self._stop - self._start)
+        if index == 0:
+            res: Audio = self.__view(start, stop)
+            self._start += stop
+            self._changed()
+        else:
+            res: Audio = self.__from_samples(self.__samples()[start:stop].copy())
+            self.__remove(start, stop)
+
+        return res
+
+    def encode(self, encoding: str = "wav") -> bytes:
+        """
+        :param encoding: One of ENCODINGS
+        :return: The audio in that container format. This is memoised until the samples change.
+        """
+        encoded: bytes | None = self._encodings.get(encoding)
+        if encoded is None:
+            buffer = BytesIO()
+            self.__write(buffer, encoding)
+            encoded = buffer.getvalue()
+            self._encodings[encoding] = encoded
+        return encoded
+
+    def stream(self, encoding: str = "wav") -> BytesIO:
+        return BytesIO(self.encode(encoding))
+
+    def save(self, filename: str, encoding: str = "wav") -> None:
+        with open(filename, "wb") as fh:
+            fh.write(self.encode(encoding))
 
     def seconds(self):
-        return sum(chunk.frames() for chunk in self.chunks) / self.frame_rate
+        return self.frames() / self.frame_rate
 
     def frames(self):
-        return sum(chunk.frames() for chunk in self.chunks)
+        return (self._stop - self._start) // self.channels
 
     def root_mean_square_energy(self) -> float:
-        return sum(chk.mean_square_energy() * chk.frames() / self.frames() for chk in self.chunks) ** 0.5
+        return float(self.statistics().total().root_mean_square_energy[0])
 
-    def __find_chunk_at(self, time: float, default_to_end: bool = False, loop: bool = False) -> int:
-        if time is None:
-            return len(self.chunks) if default_to_end else 0
+    def peak(self) -> float:
+        return float(self.statistics().total().peak[0])
 
-        whole, frac = divmod(time, self.seconds())
-        res = int(whole) * len(self.chunks)
+    def dc_offset(self) -> float:
+        return float(self.statistics().total().dc_offset[0])
 
-        frames: int = 0
-        target_frames: float = time * self.frame_rate
-        for i, chunk in enumerate(self.chunks):
-            frames += chunk.frames()
-            if frames > target_frames:
-                res += i
-                break
+    def zero_crossing_rate(self) -> float:
+        return float(self.statistics().total().zero_crossing_rate[0])
 
-        assert loop or 0 <= res <= len(self.chunks)
+    def __find_frame_at(self, time: float, default_to_end: bool = False, loop: bool = False) -> int:
+        """
+        Sample-accurate lookup: Since all frames are stored contiguously, the index is a single multiplication.
+        :return: The index of the first frame at or after time. With loop, times beyond the end refer to the audio
+                 repeated infinitely.
+        """
+        if time is None:
+            return self.frames() if default_to_end else 0
+
+        res: int = round(time * self.frame_rate)
+        assert loop or 0 <= res <= self.frames()
         return res
 
+    def __looped_samples(self, start: int, stop: int) -> ndarray:
+        """
+        Copies the samples in [start, stop) of the audio repeated infinitely, relative to _start.
+        """
+        samples: ndarray = self.__samples()
+        used: int = len(samples)
+        start_whole, start_mod = divmod(start, used)
+        stop_whole, stop_mod = divmod(stop, used)
+        if start_whole == stop_whole:
+            return samples[start_mod:stop_mod].copy()
+
+        res: ndarray = np.empty(stop - start, dtype=samples.dtype)
+        head: int = used - start_mod
+        res[:head] = samples[start_mod:]
+        res[head:len(res) - stop_mod].reshape(-1, used)[:] = samples
+        res[len(res) - stop_mod:] = samples[:stop_mod]
+        return res
+
+    def __remove(self, start: int, stop: int) -> None:
+        """
+        Removes the section [start, stop) (relative to _start) by moving whichever side of it is shorter
+        """
+        self.__reserve(0)
+        if start < self._stop - self._start - stop:
+            self._buffer[self._start + stop - start:self._start + stop] = self._buffer[self._start:self._start + start]
+            self._start += stop - start
+        else:
+            self._buffer[self._start + start:self._stop - (stop - start)] = self._buffer[self._start + stop:self._stop]
+            self._stop -= stop - start
+        self._changed()
+
     def copy(self, start_time: float = None, end_time: float = None, loop: bool = True) -> Any:
-        start_chunk = self.__find_chunk_at(start_time, False, loop)
-        end_chunk = self.__find_chunk_at(end_time, True, loop)
-        self._logger.debug(f"Copy start chunk: '{start_chunk}'")
-        self._logger.debug(f"Copy end chunk: '{end_chunk}'")
+        start_frame = self.__find_frame_at(start_time, False, loop)
+        end_frame = self.__find_frame_at(end_time, True, loop)
+        self._logger.debug(f"Copy start frame: '{start_frame}'")
+        self._logger.debug(f"Copy end frame: '{end_frame}'")
 
-        start_whole, start_mod_chunks = divmod(start_chunk, len(self.chunks))
-        end_whole, end_mod_chunks = divmod(end_chunk, len(self.chunks))
+        if not loop:
+            end_frame = min(end_frame, self.frames())
+        if end_frame <= start_frame or not self.frames():
+            return self.__view(0, 0)
 
-        if loop and not start_whole == end_whole:
-            whole_sections = max(end_whole - start_whole - 1, 0)
-            chunks = self.chunks[start_mod_chunks:] + whole_sections * self.chunks + self.chunks[:end_mod_chunks]
-        else:
-            chunks = self.chunks[start_chunk:end_chunk]
+        start_whole, start_frame = divmod(start_frame, self.frames())
+        end_frame -= start_whole * self.frames()
+        if end_frame <= self.frames():
+            return self.__view(start_frame * self.channels, end_frame * self.channels)
 
-        return Audio(chunks=chunks,
-                     channels=self.channels,
-                     frame_rate=self.frame_rate,
-                     sample_width=self.sample_width)
+        return self.__from_samples(self.__looped_samples(start_frame * self.channels, end_frame * self.channels))
 
     def cut_out(self, start_time: float = None, end_time: float = None) -> Any:
-        start_chunk = self.__find_chunk_at(start_time, False)
-        end_chunk = self.__find_chunk_at(end_time, True)
-        self._logger.debug(f"Cut-out start chunk: '{start_chunk}'")
-        self._logger.debug(f"Cut-out end chunk: '{end_chunk}'")
-        res = Audio(chunks=self.chunks[start_chunk:end_chunk],
-                    channels=self.channels,
-                    frame_rate=self.frame_rate,
-                    sample_width=self.sample_width)
-        self.chunks = self.chunks[:start_chunk] + self.chunks[end_chunk:]
+        start_frame = self.__find_frame_at(start_time, False)
+        end_frame = self.__find_frame_at(end_time, True)
+        self._logger.debug(f"Cut-out start frame: '{start_frame}'")
+        self._logger.debug(f"Cut-out end frame: '{end_frame}'")
+
+        start: int = start_frame * self.channels
+        stop: int = max(end_frame * self.channels, start)
+        if start == 0 or stop == self._stop - self._start:
+            # Cutting at either end only moves the window, both sides can keep sharing the buffer
+            res: Audio = self.__view(start, stop)
+            if start == 0:
+                self._start += stop
+            else:
+                self._stop -= stop - start
+            self._changed()
+        else:
+            res: Audio = self.__from_samples(self.__samples()[start:stop].copy())
+            self.__remove(start, stop)
         return res
 
     def insert(self, other: Any, insertion_time: int = None) -> None:
@@ -240,40 +483,101 @@ class Audio(Loggable):
         assert other.frame_rate == self.frame_rate
         assert other.sample_width == self.sample_width
         assert other.using_float == self.using_float
-        insertion_chunk = self.__find_chunk_at(insertion_time, True)
-        self._logger.debug(f"Insertion before chunk: '{insertion_chunk}'")
-        self.chunks = self.chunks[:insertion_chunk] + other.chunks + self.chunks[insertion_chunk:]
+        insertion_frame = self.__find_frame_at(insertion_time, True)
+        self._logger.debug(f"Insertion before frame: '{insertion_frame}'")
+
+        inserted: ndarray = other.__samples()
+        self.__reserve(len(inserted))
+        position: int = self._start + insertion_frame * self.channels
+        self._buffer[position + len(inserted):self._stop + len(inserted)] = self._buffer[position:self._stop]
+        self._buffer[position:position + len(inserted)] = inserted
+        self._stop += len(inserted)
+        self._changed()
 
     def repeat(self, scalar: float | int) -> Any:
         assert isinstance(scalar, float) or isinstance(scalar, int)
         assert scalar >= 0
         return self.copy(end_time=self.seconds() * scalar, loop=True)
 
-    def __to_int(self, sample_width: int = 2) -> None:
+    @staticmethod
+    def mix(sources: List[Any], offsets: List[float] = None, gains: List[float] = None) -> Any:
+        """
+        Mixes any number of audio objects into one preallocated buffer, without padding or intermediate copies.
+        :param sources: Audio objects with the same channels and frame rate
+        :param offsets: Start time of each source in seconds (sample-accurate), defaults to all 0
+        :param gains: Factor for each source, defaults to all 1
+        :return: Audio in the format of the first source, long enough for the latest ending source
+        """
+        assert sources
+        first: Audio = sources[0]
+        offsets = offsets or [0.0] * len(sources)
+        gains = gains or [1.0] * len(sources)
+        assert len(offsets) == len(sources) and len(gains) == len(sources)
+
+        starts: List[int] = [round(offset * first.frame_rate) * first.channels for offset in offsets]
+        assert all(start >= 0 for start in starts)
+        length: int = max(start + source.frames() * first.channels for start, source in zip(starts, sources))
+
+        # Integer audio is summed as floats and only clipped once at the end
+        accumulator: np.dtype = Conversion.working_d_type() if first.sample_width <= 2 else np.dtype(np.float64)
+        res: ndarray = np.zeros(length, dtype=first.d_type if first.using_float else accumulator)
+        scratch: ndarray = np.empty(max(source.frames() * first.channels for source in sources), dtype=res.dtype)
+        for source, start, gain in zip(sources, starts, gains):
+            assert source.channels == first.channels
+            assert source.frame_rate == first.frame_rate
+            samples: ndarray = source.__samples()
+            samples = Conversion.convert(samples, first.d_type)
+
+            section: ndarray = res[start:start + len(samples)]
+            if gain == 1.0:
+                np.add(section, samples, out=section, casting="unsafe")
+            else:
+                np.multiply(samples, gain, out=scratch[:len(samples)], casting="unsafe")
+                np.add(section, scratch[:len(samples)], out=section)
+
+        if not first.using_float:
+            limits: np.iinfo = np.iinfo(first.d_type)
+            res = np.rint(res, out=res).clip(limits.min, limits.max, out=res).astype(first.d_type)
+
+        return first.__from_samples(res)
+
+    def __convert(self, d_type: np.dtype, dither: bool = False) -> None:
+        """
+        Converts the whole buffer in one call. If nobody else looks at the buffer, it may be reused as scratch space.
+        """
+        self.__adopt(Conversion.convert(self.__samples(), d_type, dither, in_place=self._storage.writable))
+
+    def __to_int(self, sample_width: int = 2, dither: bool = False) -> None:
         if not self.using_float and self.sample_width == sample_width:
             return
 
-        for chunk in self.chunks:
-            chunk.to_int(sample_width)
-
+        self.__convert(np.dtype(f"i{sample_width}"), dither)
         self.sample_width = sample_width
         self.using_float = False
 
-    def __to_float(self, sample_width: int = 4) -> None:
+    def __to_float(self, sample_width: int = None) -> None:
+        sample_width = sample_width or Conversion.WORKING_SAMPLE_WIDTH
         if self.using_float and self.sample_width == sample_width:
             return
 
-        for chunk in self.chunks:
-            chunk.to_float(sample_width)
-
+        self.__convert(np.dtype(f"f{sample_width}"))
         self.sample_width = sample_width
         self.using_float = True
 
-    def to_format(self, sample_width: int, using_float: bool):
+    def to_format(self, sample_width: int, using_float: bool, dither: bool = False):
+        """
+        :param dither: Add TPDF dither when converting to a lower resolution integer format
+        """
         if using_float:
             self.__to_float(sample_width)
         else:
-            self.__to_int(sample_width)
+            self.__to_int(sample_width, dither)
+
+    def to_working_format(self) -> None:
+        """
+        Converts to the float format that processing computes in, see Conversion.WORKING_SAMPLE_WIDTH
+        """
+        self.__to_float(Conversion.WORKING_SAMPLE_WIDTH)
 
     def to_standard_width(self) -> None:
         if self.using_float:
@@ -281,51 +585,123 @@ class Audio(Loggable):
         else:
             self.__to_int()
 
-    def __align(self, other: Any) -> Tuple[Any, Any]:
-        assert isinstance(other, Audio)
+    def __adopt_values(self, values: ndarray) -> None:
+        """
+        Adopts float values (in the scale of the current format) as samples of the current format
+        """
+        if not self.using_float and values.dtype.kind == "f":
+            limits: np.iinfo = np.iinfo(self.d_type)
+            values = np.rint(values).clip(limits.min, limits.max)
+        self.__adopt(values.astype(self.d_type, copy=False).reshape(-1))
+
+    def resample(self, frame_rate: int) -> None:
+        """
+        Converts to another frame rate with a polyphase filter, all channels at once.
+        """
+        if frame_rate == self.frame_rate:
+            return
+        if not self.frames():
+            self.frame_rate = frame_rate
+            self._changed()
+            return
+
+        ratio: Fraction = Fraction(frame_rate, self.frame_rate)
+        frames: ndarray = self.__samples().reshape(-1, self.channels)
+        if not self.using_float:
+            frames = frames.astype(Conversion.working_d_type())
+        self.__adopt_values(resample_poly(frames, ratio.numerator, ratio.denominator, axis=0))
+        self.frame_rate = frame_rate
+
+    def to_channels(self, channels: int) -> None:
+        """
+        Up-mixes by duplicating a mono signal, down-mixes by averaging all channels.
+        Other combinations go through mono.
+        """
+        if channels == self.channels:
+            return
+
+        frames: ndarray = self.__samples().reshape(-1, self.channels)
+        if self.channels > 1:
+            frames = frames.mean(axis=1, keepdims=True, dtype=np.float64 if self.sample_width > 4 else Conversion.working_d_type())
+        self.__adopt_values(np.repeat(frames, channels, axis=1))
+        self.channels = channels
+
+    def to_device_format(self, sample_width: int, using_float: bool, channels: int, frame_rate: int) -> None:
+        """
+        Converts everything at once, in the order that keeps the number of processed samples small
+        """
+        if channels < self.channels:
+            self.to_channels(channels)
+        if frame_rate < self.frame_rate:
+            self.resample(frame_rate)
+        self.to_format(sample_width, using_float)
+        self.resample(frame_rate)
+        self.to_channels(channels)
+
+    def __apply(self, other: Any, operation: Any) -> None:
+        """
+        Applies operation element-wise in place (copying the buffer first if it is shared).
+        With another audio object, the result has the format of other and the length of the longer operand, the shorter
+        one counts as zero-padded. An array needs one value per frame, which applies to all channels of that frame.
+        """
+        if isinstance(other, ndarray):
+            assert len(other) == self.frames()
+            self.__reserve(0)
+            frames: ndarray = self.__samples().reshape(-1, self.channels)
+            operation(frames, other[:, np.newaxis], out=frames, casting="unsafe")
+            self._changed()
+            return
+
+        if not isinstance(other, Audio):
+            assert isinstance(other, float) or isinstance(other, int)
+            self.__reserve(0)
+            operation(self.__samples(), other, out=self.__samples(), casting="unsafe")
+            self._changed()
+            return
+
         assert self.channels == other.channels
         assert self.frame_rate == other.frame_rate
-        self.normalise_chunks(self.DEFAULT_CHUNK_SIZE)
-        other.normalise_chunks(self.DEFAULT_CHUNK_SIZE)
-        working_length = max(len(self.chunks), len(other.chunks))
-        if len(self.chunks) < len(other.chunks):
-            shorter, longer = self, other
-        else:
-            longer, shorter = other, self
-        res: Audio = deepcopy(shorter)
-        res.to_format(longer.sample_width, longer.using_float)
-        res.extend_zeros(self.DEFAULT_CHUNK_SIZE, working_length)
-        longer.extend_zeros(self.DEFAULT_CHUNK_SIZE, working_length)
-        return res, longer
+        self.to_format(other.sample_width, other.using_float)
+
+        other_samples: ndarray = other.__samples()
+        missing_samples: int = len(other_samples) - (self._stop - self._start)
+        self.__reserve(max(missing_samples, 0))
+        if missing_samples > 0:
+            self._buffer[self._stop:self._stop + missing_samples] = 0
+            self._stop += missing_samples
+
+        own: ndarray = self.__samples()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            operation(own[:len(other_samples)], other_samples, out=own[:len(other_samples)], casting="unsafe")
+            if operation is not np.add:
+                operation(own[len(other_samples):], 0, out=own[len(other_samples):], casting="unsafe")
+        self._changed()
+
+    def __iadd__(self, other: Any):
+        self.__apply(other, np.add)
+        return self
+
+    def __imul__(self, other: Any):
+        self.__apply(other, np.multiply)
+        return self
+
+    def __itruediv__(self, other: Any):
+        self.__apply(other, np.true_divide)
+        return self
 
     def __add__(self, other: Any):
-        res, to_add = self.__align(other)
-        for i in range(len(res.chunks)):
-            res.chunks[i] += to_add.chunks[i]
+        res: Audio = self.copy()
+        res += other
         return res
 
     def __mul__(self, other: Any):
-        if isinstance(other, Audio):
-            res, to_mul = self.__align(other)
-            for i in range(len(res.chunks)):
-                res.chunks[i] *= to_mul.chunks[i]
-        else:
-            assert isinstance(other, float) or isinstance(other, int)
-            res = deepcopy(self)
-            for i in range(len(res.chunks)):
-                res.chunks[i] *= other
+        res: Audio = self.copy()
+        res *= other
         return res
 
     def __truediv__(self, other: Any):
-        if isinstance(other, Audio):
-            res, to_mul = self.__align(other)
-            for i in range(len(res.chunks)):
-                res.chunks[i] /= to_mul.chunks[i]
-        else:
-            assert isinstance(other, float) or isinstance(other, int)
-            res = deepcopy(self)
-            for i in range(len(res.chunks)):
-                res.chunks[i] /= other
+        res: Audio = self.copy()
+        res /= other
         return res
 
 
@@ -0,0 +1,216 @@
+# External libs
+import wave
+import numpy as np
+from soundfile import SoundFile
+
+# Internal libs
+from peripherals.audio.audio import Audio
+from peripherals.audio.chunk import Chunk
+from peripherals.audio.resampler import Resampler
+from peripherals.audio.wav_file import WavFile
+
+# General utilities
+from io import BytesIO
+from itertools import chain
+from typing import Iterable, Iterator, Callable, Any
+
+
+class AudioStream:
+    """
+    A lazily evaluated sequence of chunks with a fixed format.
+
+    Sources produce the chunks on demand and sinks consume them one by one, so processing can start on the first chunk
+    and memory stays bounded no matter how long the audio is. A stream can only be consumed once.
+    """
+
+    sample_width: int = None
+    channels: int = None
+    frame_rate: int = None
+    using_float: bool = None
+
+    __chunks: Iterator[Chunk] = None
+
+    def __init__(self, chunks: Iterable[Chunk | np.ndarray], channels: int, frame_rate: int, sample_width: int,
+                 using_float: bool = None):
+        self.__chunks = iter(chunks)
+        self.channels = channels
+        self.frame_rate = frame_rate
+        self.sample_width = sample_width
+        self.using_float = Audio._using_float_convention(sample_width) if using_float is None else using_float
+
+    def __iter__(self) -> Iterator[Chunk]:
+        return self
+
+    def __next__(self) -> Chunk:
+        chunk: Chunk | np.ndarray = next(self.__chunks)
+        return Chunk(nparray=chunk) if isinstance(chunk, np.ndarray) else chunk
+
+    def map(self, function: Callable[[Chunk], Chunk]) -> Any:
+        """
+        Adds a processing stage that keeps the format
+        :param function: Applied to every chunk once it is requested
+        :return: The processed stream
+        """
+        return AudioStream(map(function, self), self.channels, self.frame_rate, self.sample_width, self.using_float)
+
+    def to_format(self, sample_width: int, using_float: bool) -> Any:
+        """
+        Adds a stage that converts every chunk to another sample format
+        """
+        if sample_width == self.sample_width and using_float == self.using_float:
+            return self
+
+        d_type: np.dtype = np.dtype(f"{'f' if using_float else 'i'}{sample_width}")
+
+        def convert(chunk: Chunk) -> Chunk:
+            chunk.to_d_type(d_type)
+            return chunk
+
+        return AudioStream(map(convert, self), self.channels, self.frame_rate, sample_width, using_float)
+
+    def to_channels(self, channels: int) -> Any:
+        """
+        Adds a stage that up- or down-mixes every chunk, like Audio.to_channels
+        """
+        if channels == self.channels:
+            return self
+
+        def convert(chunk: Chunk) -> np.ndarray:
+            audio: Audio = self.to_audio(chunk)
+            audio.to_channels(channels)
+            return audio.nparray()
+
+        return AudioStream(map(convert, self), channels, self.frame_rate, self.sample_width, self.using_float)
+
+    def resample(self, frame_rate: int) -> Any:
+        """
+        Adds a stage that converts to another frame rate. The resampler carries its state from chunk to chunk, so the
+        result is the same as resampling the whole audio at once.
+        """
+        if frame_rate == self.frame_rate:
+            return self
+
+        resampler: Resampler = Resampler(self.frame_rate, frame_rate, self.channels)
+        d_type: np.dtype = np.dtype(f"{'f' if self.using_float else 'i'}{self.sample_width}")
+
+        def convert(frames: np.ndarray) -> np.ndarray:
+            if not self.using_float:
+                limits: np.iinfo = np.iinfo(d_type)
+                frames = np.rint(frames).clip(limits.min, limits.max)
+            return frames.astype(d_type).reshape(-1)
+
+        def chunks() -> Iterator[np.ndarray]:
+            for chunk in self:
+                frames: np.ndarray = resampler.process(chunk.nparray().reshape(-1, self.channels))
+                if len(frames):
+                    yield convert(frames)
+            frames: np.ndarray = resampler.flush()
+            if len(frames):
+                yield convert(frames)
+
+        return AudioStream(chunks(), self.channels, frame_rate, self.sample_width, self.using_float)
+
+    def to_device_format(self, sample_width: int, using_float: bool, channels: int, frame_rate: int) -> Any:
+        """
+        Adds the stages to convert to a device format, in the order that keeps the number of processed samples small
+        """
+        stream: AudioStream = self
+        if channels < stream.channels:
+            stream = stream.to_channels(channels)
+        if frame_rate < stream.frame_rate:
+            stream = stream.resample(frame_rate)
+        return stream.to_format(sample_width, using_float).resample(frame_rate).to_channels(channels)
+
+    def to_audio(self, chunk: Chunk = None) -> Audio:
+        """
+        :param chunk: If given, wraps this chunk instead of consuming the whole stream
+        :return: An audio object in the format of this stream
+        """
+        return Audio(chunks=[chunk] if chunk is not None else list(self),
+                     channels=self.channels,
+                     frame_rate=self.frame_rate,
+                     sample_width=self.sample_width)
+
+    def save(self, target: BytesIO | str) -> None:
+        """
+        Sink that writes the stream to a wav file chunk by chunk, float streams are written as int16
+        """
+        stream: AudioStream = self.to_format(2, False) if self.using_float else self
+        with wave.open(target, "wb") as wf:
+            wf.setnchannels(stream.channels)
+            wf.setsampwidth(stream.sample_width)
+            wf.setframerate(stream.frame_rate)
+            for chunk in stream:
+                wf.writeframes(chunk.nparray())
+
+    def encode(self, encoding: str = "wav") -> bytes:
+        """
+        Sink that compresses the stream chunk by chunk, float streams are written as int16
+        :param encoding: One of Audio.ENCODINGS
+        :return: The stream in that container format
+        """
+        buffer: BytesIO = BytesIO()
+        if encoding == "wav":
+            self.save(buffer)
+            return buffer.getvalue()
+
+        stream: AudioStream = self
+        if encoding == "opus" and stream.frame_rate not in Audio.OPUS_FRAME_RATES:
+            # Opus only supports a few frame rates
+            stream = stream.resample(min((rate for rate in Audio.OPUS_FRAME_RATES if rate >= stream.frame_rate),
+                                         default=48000))
+        stream = stream.to_format(2, False)
+
+        sound_format, subtype, _ = Audio.ENCODINGS[encoding]
+        with SoundFile(buffer, 'w', stream.frame_rate, stream.channels, subtype, format=sound_format) as sound_file:
+            for chunk in stream:
+                sound_file.write(chunk.nparray().reshape(-1, stream.channels))
+        return buffer.getvalue()
+
+    @staticmethod
+    def from_audio(audio: Audio) -> Any:
+        return AudioStream(audio.iter_chunks(), audio.channels, audio.frame_rate, audio.sample_width, audio.using_float)
+
+    @staticmethod
+    def from_audios(audios: Iterable[Audio]) -> Any:
+        """
+        Chains audio objects of the same format, e.g. utterances from a microphone. Blocks until the first one arrives,
+        since it determines the format of the stream.
+        """
+        audios = iter(audios)
+        first: Audio = next(audios)
+
+        def chunks() -> Iterator[Chunk]:
+            for audio in chain([first], audios):
+                assert audio.frame_rate == first.frame_rate and audio.channels == first.channels
+                audio = audio.copy()
+                audio.to_format(first.sample_width, first.using_float)
+                yield from audio.iter_chunks()
+
+        return AudioStream(chunks(), first.channels, first.frame_rate, first.sample_width, first.using_float)
+
+    @staticmethod
+    def from_wav_file(filename: str, chunk_size: int = Audio.DEFAULT_CHUNK_SIZE) -> Any:
+        """
+        Source that reads the memory-mapped file one chunk at a time
+        """
+        wav_file: WavFile = WavFile(filename)
+        step: int = chunk_size * wav_file.channels
+        chunks: Iterator[np.ndarray] = (wav_file.samples[start:start + step]
+                                        for start in range(0, len(wav_file.samples), step))
+        return AudioStream(chunks, wav_file.channels, wav_file.frame_rate, wav_file.sample_width, wav_file.using_float)
+
+    @staticmethod
+    def from_ogg_buffer(buffer: BytesIO, chunk_size: int = Audio.DEFAULT_CHUNK_SIZE) -> Any:
+        """
+        Source that decodes an ogg (e.g. opus) buffer one chunk at a time.
+        Note: libsndfile seeks to the end of ogg streams when opening them, so the encoded bytes have to be complete.
+        """
+        sound_file: SoundFile = SoundFile(buffer, 'r')
+
+        def chunks() -> Iterator[np.ndarray]:
+            with sound_file:
+                for block in sound_file.blocks(chunk_size, dtype='int16'):
+                    yield block.reshape(-1)
+
+        return AudioStream(chunks(), sound_file.channels, sound_file.samplerate, 2, False)
@@ -0,0 +1,273 @@
+# External libs
+import numpy as np
+
+# Internal libs
+from peripherals.audio.audio import Audio
+from peripherals.audio.chunk import Chunk
+from peripherals.audio.synthesizer.note import Note
+from peripherals.audio.synthesizer.shape import Shape
+from peripherals.audio.synthesizer.synthesizer import Synthesizer
+
+from infra.log.loggable import Loggable
+
+# General utilities
+import json
+import platform
+from io import BytesIO
+from os import makedirs
+from os.path import join, dirname, pardir, realpath, isfile
+from timeit import Timer
+from typing import List, Dict, Tuple, Callable, Any
+
+
+class Benchmark(Loggable):
+    """
+    Offline micro-benchmarks of the audio core, no audio devices needed.
+
+    Every case is timed for several audio lengths, in short rounds that are interleaved over all cases, so that a slow
+    phase of the machine only affects some rounds of every case. The median of the rounds counts, and their
+    interquartile range relative to the median is the spread of the case.
+
+    Results are compared against a JSON baseline per machine type (e.g. x86_64 and aarch64 for the Pi). A case counts
+    as regressed if its median got slower than the baseline by more than its tolerance, i.e. the threshold or a
+    multiple of the spread of either measurement if that is larger, and by more than the floor.
+    """
+
+    FRAME_RATE: int = 44100
+    DEFAULT_SIZES: List[float] = [0.1, 1.0, 5.0]
+    DEFAULT_THRESHOLD: float = 0.25
+    DEFAULT_FLOOR: float = 50e-6
+    # Multiple of the spread of a case up to which a change counts as noise
+    SPREAD_FACTOR: float = 2.0
+    # Seconds that every case is timed for in each round
+    ROUND_SECONDS: float = 0.04
+    BASELINE_DIR: str = realpath(join(dirname(__file__), pardir, pardir, "files", "benchmarks"))
+
+    sizes: List[float] = None
+
+    __rounds: int = None
+
+    def __init__(self, sizes: List[float] = None, rounds: int = 15):
+        """
+        :param sizes: Audio lengths in seconds
+        :param rounds: Number of timing rounds over all cases
+        """
+        super().__init__()
+        self.sizes = sizes or self.DEFAULT_SIZES
+        self.__rounds = rounds
+
+    @staticmethod
+    def __sine(seconds: float, sample_width: int = 2, using_float: bool = False) -> Audio:
+        factor: float = 2 * np.pi * 440 / Benchmark.FRAME_RATE
+        samples: np.ndarray = np.sin(np.arange(int(seconds * Benchmark.FRAME_RATE)) * factor)
+        audio: Audio = Audio(samples * 0.5, frame_rate=Benchmark.FRAME_RATE)
+        audio.to_format(sample_width, using_float)
+        return audio
+
+    @staticmethod
+    def __invalidate(audio: Audio, chunk_sizes: List[int]) -> None:
+        """
+        Drops everything the audio cached, by switching between two chunk sizes
+        """
+        chunk_sizes.reverse()
+        audio.normalise_chunks(chunk_sizes[0])
+
+    @staticmethod
+    def cases() -> Dict[str, Callable[[float], Callable[[], Any]]]:
+        """
+        :return: Each case prepares its inputs for a length in seconds and returns the function to time
+        """
+
+        def chunk_to_int(seconds: float) -> Callable[[], Any]:
+            samples: np.ndarray = Benchmark.__sine(seconds, 4, True).nparray()
+            return lambda: Chunk(nparray=samples).to_int(2)
+
+        def chunk_to_float(seconds: float) -> Callable[[], Any]:
+            samples: np.ndarray = Benchmark.__sine(seconds).nparray()
+            return lambda: Chunk(nparray=samples).to_float(4)
+
+        def normalise_chunks(seconds: float) -> Callable[[], Any]:
+            audio: Audio = Benchmark.__sine(seconds)
+            chunk_sizes: List[int] = [512, 1024]
+
+            def run() -> None:
+                chunk_sizes.reverse()
+                audio.normalise_chunks(chunk_sizes[0])
+                for _ in audio.iter_chunks():
+                    pass
+            return run
+
+        def copy(seconds: float) -> Callable[[], Any]:
+            audio: Audio = Benchmark.__sine(seconds)
+            return lambda: audio.copy(0.25 * seconds, 2.5 * seconds)
+
+        def cut_out(seconds: float) -> Callable[[], Any]:
+            audio: Audio = Benchmark.__sine(seconds)
+            return lambda: audio.copy().cut_out(0.25 * seconds, 0.5 * seconds)
+
+        def insert(seconds: float) -> Callable[[], Any]:
+            audio: Audio = Benchmark.__sine(seconds)
+            return lambda: audio.copy().insert(audio, 0.5 * seconds)
+
+        def add(seconds: float) -> Callable[[], Any]:
+            audio: Audio = Benchmark.__sine(seconds)
+            return lambda: audio + audio
+
+        def mul(seconds: float) -> Callable[[], Any]:
+            audio: Audio = Benchmark.__sine(seconds, 4, True)
+            return lambda: audio * audio
+
+        def root_mean_square_energy(seconds: float) -> Callable[[], Any]:
+            audio: Audio = Benchmark.__sine(seconds)
+            chunk_sizes: List[int] = [1024, 1023]
+
+            def run() -> float:
+                Benchmark.__invalidate(audio, chunk_sizes)
+                return audio.root_mean_square_energy()
+            return run
+
+        def shape_apply(seconds: float) -> Callable[[], Any]:
+            audio: Audio = Benchmark.__sine(seconds, 8, True)
+            shape: Shape = Shape(Shape.SHARP_START, 'slinear')
+            return lambda: shape.apply(audio.copy())
+
+        def synthesizer_chord(seconds: float) -> Callable[[], Any]:
+            synthesizer: Synthesizer = Synthesizer(Benchmark.FRAME_RATE)
+            note: Note = Note("C", 4)
+            return lambda: synthesizer.chord(note, length=seconds)
+
+        def encode(encoding: str) -> Callable[[float], Callable[[], Any]]:
+            def case(seconds: float) -> Callable[[], Any]:
+                audio: Audio = Benchmark.__sine(seconds)
+                chunk_sizes: List[int] = [1024, 1023]
+
+                def run() -> bytes:
+                    Benchmark.__invalidate(audio, chunk_sizes)
+                    return audio.encode(encoding)
+                return run
+            return case
+
+        def decode_wav(seconds: float) -> Callable[[], Any]:
+            encoded: bytes = Benchmark.__sine(seconds).encode("wav")
+            return lambda: Audio(wav_buffer=BytesIO(encoded)).load()
+
+        def decode_ogg(seconds: float) -> Callable[[], Any]:
+            encoded: bytes = Benchmark.__sine(seconds).encode("ogg")
+            return lambda: Audio(ogg_buffer=BytesIO(encoded))
+
+        return {"chunk.to_int": chunk_to_int,
+                "chunk.to_float": chunk_to_float,
+                "audio.normalise_chunks": normalise_chunks,
+                "audio.copy": copy,
+                "audio.cut_out": cut_out,
+                "audio.insert": insert,
+                "audio.add": add,
+                "audio.mul": mul,
+                "audio.root_mean_square_energy": root_mean_square_energy,
+                "shape.apply": shape_apply,
+                "synthesizer.chord": synthesizer_chord,
+                "wav.encode": encode("wav"),
+                "wav.decode": decode_wav,
+                "ogg.encode": encode("ogg"),
+                "ogg.decode": decode_ogg}
+
+    def run(self, name_filter: str = None) -> Dict[str, Dict[str, float]]:
+        """
+        :param name_filter: Only run cases whose name contains this
+        :return: The median seconds per call and the spread of each case, keyed by '<case>@<length>s'
+        """
+        timers: Dict[str, Tuple[Timer, int]] = {}
+        for name, case in self.cases().items():
+            if name_filter and name_filter not in name:
+                continue
+            for seconds in self.sizes:
+                timer: Timer = Timer(case(seconds))
+                # The first calls warm up caches
+                seconds_per_call: float = min(timer.repeat(3, 1))
+                timers[f"{name}@{seconds}s"] = (timer, max(int(self.ROUND_SECONDS / seconds_per_call), 1))
+
+        rounds: Dict[str, List[float]] = {key: [] for key in timers}
+        for _ in range(self.__rounds):
+            for key, (timer, number) in timers.items():
+                rounds[key].append(timer.timeit(number) / number)
+
+        results: Dict[str, Dict[str, float]] = {}
+        for key, times in rounds.items():
+            lower, median, upper = np.percentile(times, [25, 50, 75])
+            results[key] = {"median": float(median), "spread": float((upper - lower) / median)}
+            self._logger.info(f"{key:<40}{median * 1000:>12.3f} ms  ±{results[key]['spread']:.0%}")
+        return results
+
+    @staticmethod
+    def baseline_path() -> str:
+        return join(Benchmark.BASELINE_DIR, f"{platform.machine() or 'unknown'}.json")
+
+    @staticmethod
+    def load_baseline() -> Dict[str, Dict[str, float]]:
+        if not isfile(Benchmark.baseline_path()):
+            return {}
+        with open(Benchmark.baseline_path(), "r") as fh:
+            return json.load(fh)["results"]
+
+    @staticmethod
+    def save_baseline(results: Dict[str, Dict[str, float]]) -> None:
+        """
+        Merges the results into the baseline of this machine type
+        """
+        baseline: Dict[str, Dict[str, float]] = Benchmark.load_baseline()
+        baseline.update(results)
+        makedirs(Benchmark.BASELINE_DIR, exist_ok=True)
+        with open(Benchmark.baseline_path(), "w") as fh:
+            json.dump({"machine": platform.machine(),
+                       "python": platform.python_version(),
+                       "numpy": np.__version__,
+                       "results": dict(sorted(baseline.items()))}, fh, indent=2)
+
+    def compare(self, results: Dict[str, Dict[str, float]], threshold: float = DEFAULT_THRESHOLD,
+                floor: float = DEFAULT_FLOOR) -> List[str]:
+        """
+        :param threshold: Allowed slowdown relative to the baseline, e.g. 0.25 for 25%, for cases with a small spread
+        :param floor: Allowed slowdown in seconds per call regardless of the tolerance
+        :return: The keys of all regressed cases
+        """
+        baseline: Dict[str, Dict[str, float]] = self.load_baseline()
+        regressions: List[str] = []
+        for key, result in results.items():
+            if key not in baseline:
+                self._logger.info(f"{key}: no baseline")
+                continue
+            expected: Dict[str, float] = baseline[key]
+            if abs(result["median"] - expected["median"]) <= floor:
+                continue
+            change: float = result["median"] / expected["median"] - 1.0
+            tolerance: float = max(threshold, self.SPREAD_FACTOR * max(result["spread"], expected["spread"]))
+            if change > tolerance:
+                regressions.append(key)
+                self._logger.warning(f"{key}: {change:+.0%} slower than the baseline (tolerance {tolerance:.0%})")
+            elif change < -tolerance:
+                self._logger.info(f"{key}: {-change:.0%} faster than the baseline")
+        return regressions
+
+if __name__ == '__main__':
+    from infra.log.setup import LoggingSetup
+    LoggingSetup(override_level=LoggingSetup.INFO)
+
+    from argparse import ArgumentParser
+    from sys import exit
+
+    parser: ArgumentParser = ArgumentParser(description="Audio micro-benchmarks")
+    parser.add_argument("--filter", help="Only run cases whose name contains this")
+    parser.add_argument("--sizes", type=float, nargs="+", help="Audio lengths in seconds")
+    parser.add_argument("--threshold", type=float, default=Benchmark.DEFAULT_THRESHOLD,
+                        help="Allowed slowdown relative to the baseline")
+    parser.add_argument("--floor", type=float, default=Benchmark.DEFAULT_FLOOR,
+                        help="Allowed slowdown in seconds per call regardless of the threshold")
+    parser.add_argument("--update", action="store_true", help="Store the results as the new baseline")
+    args = parser.parse_args()
+
+    benchmark: Benchmark = Benchmark(args.sizes)
+    benchmark_results: Dict[str, Dict[str, float]] = benchmark.run(args.filter)
+    if args.update:
+        Benchmark.save_baseline(benchmark_results)
+    elif benchmark.compare(benchmark_results, args.threshold, args.floor):
+        exit(1)
@@ -0,0 +1,333 @@
+# External libs
+import numpy as np
+
+# Internal libs
+from peripherals.audio.chunk import Chunk
+from peripherals.audio.conversion import Conversion
+from peripherals.audio.enums.output_channel import OutputChannel
+from peripherals.audio.playback import Playback
+
+# General utilities
+from collections import deque
+from datetime import datetime
+from threading import Lock, Condition, Thread
+from typing import List, Tuple, Deque, Callable, Dict, Set
+
+
+class BusChannel:
+    """
+    One named input of the mixing bus of an Output: a queue of playbacks in the working format, played one after the
+    other, with its own gain.
+
+    gain and ducking can be changed at any time, the new gain is ramped in over the next block to avoid clicks. The
+    queue is guarded by the lock of the Output.
+
+    Every channel pulls its streams on its own producer thread and buffers up to read_ahead samples, so that a stream
+    that blocks, e.g. while it waits for the network, never stalls the mixing thread or the other channels. The mixing
+    thread only takes what is buffered already, and mixes silence while the playback it is at has nothing yet.
+
+    The channel remembers which playback each mixed sample came from until the device has played it. This counts the
+    played frames of every playback, and allows to take back the samples that were mixed ahead when the output is
+    rewound for a cancellation: those of cancelled playbacks are dropped, all others are mixed again. The end of every
+    playback is marked by an empty segment, so that it finishes once the device has played its last frame.
+    """
+
+    name: OutputChannel = None
+    gain: float = None
+    # Factor on the gain while a channel of higher priority sounds
+    ducking: float = None
+    # Background channels keep playing while the output is paused and do not make the output active
+    background: bool = None
+
+    __lock: Lock = None
+    __queue: List[Playback] = None
+
+    # Shared by the producer and the mixing thread, guarded by the lock
+    read_ahead: int = None
+    __produced: Condition = None
+    __on_produced: Callable[[], None] = None
+    # Chunks pulled from the streams but not mixed yet, and the number of their samples
+    __buffered: Dict[Playback, Deque[np.ndarray]] = None
+    __buffered_samples: int = None
+    # Playbacks whose stream has ended, they finish once their buffered chunks are mixed
+    __exhausted: Set[Playback] = None
+    # The playback whose stream the producer waits for
+    __reading: Playback | None = None
+    # A cancellation of the playback that is being read starts a new producer, the old one stops once its stream returns
+    __generation: int = None
+    __producer: Thread | None = None
+    __closed: bool = None
+
+    # Everything below is only used by the mixing thread
+
+    # Samples that were taken back by a rewind, to be mixed again before anything else
+    __replay: Deque[Tuple[Playback, np.ndarray]] = None
+    # (absolute start index in the output, playback, samples) of everything mixed but not played yet
+    __segments: Deque[Tuple[int, Playback, np.ndarray]] = None
+
+    __applied_gain: float = None
+    __block: np.ndarray = None
+
+    def __init__(self, name: OutputChannel, lock: Lock, read_ahead: int, on_produced: Callable[[], None],
+                 gain: float = 1.0, ducking: float = 1.0, background: bool = False):
+        """
+        :param read_ahead: Samples to buffer ahead of the mixing thread
+        :param on_produced: Called by the producer thread whenever it buffered a chunk or a stream ended
+        """
+        self.name = name
+        self.gain = gain
+        self.ducking = ducking
+        self.background = background
+
+        self.__lock = lock
+        self.__queue = []
+
+        self.read_ahead = read_ahead
+        self.__produced = Condition(lock)
+        self.__on_produced = on_produced
+        self.__buffered = {}
+        self.__buffered_samples = 0
+        self.__exhausted = set()
+        self.__generation = 0
+        self.__closed = False
+
+        self.__replay = deque()
+        self.__segments = deque()
+
+        self.__applied_gain = gain
+        self.__block = np.zeros(0, dtype=Conversion.working_d_type())
+
+    def queue(self, playback: Playback, prioritise: bool = False) -> None:
+        """
+        Has to be called with the lock held
+        """
+        assert playback.stream.sample_width == Conversion.WORKING_SAMPLE_WIDTH and playback.stream.using_float
+        self.__queue.insert(0 if prioritise else len(self.__queue), playback)
+        self.__produced.notify_all()
+
+    def start(self) -> None:
+        with self.__lock:
+            self.__start_producer()
+
+    def close(self, timeout: float = 1.0) -> None:
+        """
+        Stops the producer thread. It is not waited for longer than timeout, since it may be stuck in a stream.
+        """
+        with self.__lock:
+            self.__closed = True
+            self.__produced.notify_all()
+            producer: Thread | None = self.__producer
+        if producer is not None:
+            producer.join(timeout)
+
+    def __start_producer(self) -> None:
+        """
+        Has to be called with the lock held
+        """
+        if self.__closed:
+            return
+        self.__generation += 1
+        self.__producer = Thread(target=self.__produce, args=[self.__generation],
+                                 name=f"Thread '{self.name.name.lower()}_producer'", daemon=True)
+        self.__producer.start()
+
+    def __next_to_read(self) -> Playback | None:
+        """
+        Has to be called with the lock held
+        :return: The first playback whose stream has not ended, None if there is none or enough is buffered
+        """
+        if self.__buffered_samples >= self.read_ahead:
+            return None
+        return next((playback for playback in self.__queue if playback not in self.__exhausted), None)
+
+    def __produce(self, generation: int) -> None:
+        """
+        Pulls the streams of the queued playbacks one after the other, as long as less than read_ahead is buffered
+        """
+        while True:
+            with self.__lock:
+                self.__produced.wait_for(lambda: self.__closed or self.__generation != generation
+                                         or self.__next_to_read() is not None)
+                if self.__closed or self.__generation != generation:
+                    return
+                playback: Playback = self.__next_to_read()
+                self.__reading = playback
+
+            # A stream may block while producing its next chunk, so don't hold the lock meanwhile
+            chunk: Chunk | None = next(playback.stream, None)
+            with self.__lock:
+                if self.__generation != generation:
+                    return
+                self.__reading = None
+                if playback.cancelled:
+                    continue
+                if chunk is None:
+                    self.__exhausted.add(playback)
+                else:
+                    samples: np.ndarray = chunk.nparray()
+                    self.__buffered.setdefault(playback, deque()).append(samples)
+                    self.__buffered_samples += len(samples)
+            self.__on_produced()
+
+    def __drop(self, playback: Playback) -> None:
+        """
+        Has to be called with the lock held. Forgets everything the producer buffered for the playback.
+        """
+        self.__buffered_samples -= sum(len(samples) for samples in self.__buffered.pop(playback, ()))
+        self.__exhausted.discard(playback)
+        self.__produced.notify_all()
+
+    def cancel(self, tag: str | None = None) -> List[Playback]:
+        """
+        Has to be called with the lock held. Samples that were already mixed are only dropped by the next rewind.
+        :param tag: Only cancel the playbacks with this tag, all if None
+        :return: The cancelled playbacks, including those that are being mixed again
+        """
+        candidates: List[Playback] = list(self.__queue)
+        for playback, _ in self.__replay:
+            if playback not in candidates:
+                candidates.append(playback)
+
+        cancelled: List[Playback] = [playback for playback in candidates
+                                     if not playback.cancelled and (tag is None or playback.tag == tag)]
+        for playback in cancelled:
+            playback.cancelled = True
+            self.__drop(playback)
+        self.__queue = [playback for playback in self.__queue if not playback.cancelled]
+
+        if self.__reading is not None and self.__reading.cancelled:
+            # Its stream may block for long, so the other playbacks don't wait for it
+            self.__reading = None
+            self.__start_producer()
+        return cancelled
+
+    def active(self) -> bool:
+        """
+        Has to be called with the lock held
+        :return: Whether there is still something to mix
+        """
+        return bool(self.__queue) or bool(self.__replay)
+
+    def mixed(self) -> bool:
+        """
+        :return: Whether the device has not played everything mixed yet
+        """
+        return bool(self.__segments)
+
+    def __next_samples(self) -> Tuple[Playback, np.ndarray] | None:
+        """
+        Never waits for a stream
+        :return: The next samples to mix and their playback, None if nothing is buffered
+        """
+        while self.__replay:
+            playback, samples = self.__replay.popleft()
+            if not playback.cancelled:
+                return playback, samples
+
+        with self.__lock:
+            if not self.__queue:
+                return None
+            playback: Playback = self.__queue[0]
+            chunks: Deque[np.ndarray] | None = self.__buffered.get(playback)
+            if chunks:
+                samples: np.ndarray = chunks.popleft()
+                self.__buffered_samples -= len(samples)
+                self.__produced.notify_all()
+                return playback, samples
+            if playback not in self.__exhausted:
+                return None
+
+            self.__queue.pop(0)
+            self.__drop(playback)
+            # Marks the end of the playback
+            return playback, np.zeros(0, dtype=Conversion.working_d_type())
+
+    def __read(self, out: np.ndarray, position: int) -> int:
+        """
+        Fills out with the next samples, and the rest with zeros
+        :param position: Absolute index of out in the output
+        :return: Number of samples read
+        """
+        filled: int = 0
+        while filled < len(out):
+            following: Tuple[Playback, np.ndarray] | None = self.__next_samples()
+            if following is None:
+                break
+            playback, samples = following
+
+            count: int = min(len(out) - filled, len(samples))
+            if count < len(samples):
+                # Gives back what does not fit into this block
+                self.__replay.appendleft((playback, samples[count:]))
+            out[filled:filled + count] = samples[:count]
+            self.__segments.append((position + filled, playback, out[filled:filled + count].copy()))
+            filled += count
+
+        out[filled:] = 0
+        return filled
+
+    def mix_into(self, mix: np.ndarray, position: int, channels: int, ducked: bool, ramp: np.ndarray) -> bool:
+        """
+        Adds the next block of this channel to mix, at its current gain
+        :param mix: The block of the bus in the working format
+        :param position: Absolute index of the block in the output
+        :param channels: Number of interleaved channels in mix
+        :param ducked: Whether a channel of higher priority sounds in this block
+        :param ramp: Rises from 0.0 to 1.0 over the frames of the block
+        :return: Whether this channel contributed any samples
+        """
+        if len(self.__block) != len(mix):
+            self.__block = np.zeros(len(mix), dtype=mix.dtype)
+
+        target_gain: float = self.gain * (self.ducking if ducked else 1.0)
+        if not self.__read(self.__block, position):
+            self.__applied_gain = target_gain
+            return False
+
+        if target_gain == self.__applied_gain:
+            self.__block *= target_gain
+        else:
+            gains: np.ndarray = self.__applied_gain + (target_gain - self.__applied_gain) * ramp
+            self.__block.reshape(-1, channels)[...] *= gains[:, np.newaxis]
+            self.__applied_gain = target_gain
+        mix += self.__block
+        return True
+
+    def retire(self, position: int, channels: int, time_of: Callable[[int], datetime]) -> List[Playback]:
+        """
+        Counts the frames of every segment the device has played completely, and starts and finishes the playbacks
+        :param position: Absolute index of the next sample the device plays
+        :param time_of: The time the device plays the sample at an absolute index
+        :return: The playbacks that started
+        """
+        started: List[Playback] = []
+        while self.__segments and self.__segments[0][0] + len(self.__segments[0][2]) <= position:
+            start, playback, samples = self.__segments.popleft()
+            if not len(samples):
+                playback._finish(time_of(start))
+                continue
+            if playback.started is None:
+                playback._start(time_of(start))
+                started.append(playback)
+            playback.frames_played += len(samples) // channels
+        return started
+
+    def rewind(self, position: int, channels: int, time_of: Callable[[int], datetime]) -> List[Playback]:
+        """
+        Takes back everything mixed from position on: samples of cancelled playbacks are dropped, all others are mixed
+        again. Everything before position counts as played.
+        :param position: Absolute index in the output that is mixed next
+        :param time_of: The time the device plays the sample at an absolute index
+        :return: The playbacks that started
+        """
+        taken_back: List[Tuple[Playback, np.ndarray]] = []
+        while self.__segments and self.__segments[-1][0] + len(self.__segments[-1][2]) > position:
+            start, playback, samples = self.__segments.pop()
+            if start < position:
+                self.__segments.append((start, playback, samples[:position - start]))
+                samples = samples[position - start:]
+            if not playback.cancelled:
+                taken_back.append((playback, samples))
+
+        self.__replay.extendleft(taken_back)
+        return self.retire(position, channels, time_of)
@@ -1,6 +1,11 @@
 # External libs
 import numpy as np
 
+# Internal libs
+from peripherals.audio.statistics import Statistics
+from peripherals.audio.shared_buffer import SharedBuffer
+from peripherals.audio.conversion import Conversion
+
 # General utilities
 from typing import Tuple, Any
 
@@ -13,17 +18,24 @@ class Chunk:
     between different number formats
 
     It does not know about frame rate or channels
+
+    The numpy array is never written to in place - every change binds a new array - so chunks can share memory with
+    each other and with audio objects. If the array is a view of an audio buffer, the chunk holds a reference on that
+    buffer until it changes, so the audio object copies before writing to it.
     """
 
     _bytes: bytes = None
     _d_type: np.dtype = None
     _nparray: np.ndarray = None
     _bytes_up_to_date: bool = None
+    _statistics: Statistics = None
+    _storage: SharedBuffer = None
 
     def __init__(self, raw_bytes: bytes = None,
                  sample_width: int = None,
                  using_float: bool = None,
-                 nparray: np.ndarray = None):
+                 nparray: np.ndarray = None,
+                 storage: SharedBuffer = None):
         if raw_bytes is not None:
             assert sample_width and using_float is not None
             self._bytes = raw_bytes
@@ -35,6 +47,28 @@ class Chunk:
             self._nparray = nparray
             self._d_type = nparray.dtype
             self._bytes_up_to_date = False
+            if storage is not None:
+                self._storage = storage.share()
+
+    def __del__(self):
+        if self._storage is not None:
+            self._storage.release()
+
+    def _changed(self) -> None:
+        """
+        Has to be called whenever the samples change, to invalidate everything derived from them
+        """
+        self._bytes_up_to_date = False
+        self._statistics = None
+        if self._storage is not None:
+            self._storage.release()
+            self._storage = None
+
+    def storage(self) -> SharedBuffer | None:
+        """
+        :return: The audio buffer this chunk is a view of, if any
+        """
+        return self._storage
 
     def frames(self) -> int:
         if self._nparray is not None:
@@ -59,53 +93,52 @@ class Chunk:
             self._nparray = np.frombuffer(self._bytes, dtype=self._d_type)
         return self._nparray
 
+    def statistics(self) -> Statistics:
+        """
+        :return: The signal statistics of this chunk, cached until the chunk changes
+        """
+        if self._statistics is None:
+            self._statistics = Statistics(self.nparray())
+        return self._statistics
+
     # TODO: Account for different audio formats to make energies comparable
     def mean_square_energy(self) -> float:
-        return sum(x**2/self.frames() for x in self.nparray())
+        return float(self.statistics().mean_square_energy[0]) if self.frames() else 0.0
 
-    def to_float(self, sample_width: int = 4) -> None:
-        if self.using_float() and self.sample_width() == sample_width:
-            return
-        elif self.using_float():
-            dt_to = np.dtype(f"f{sample_width}")
-            self._nparray = self.nparray().astype(dt_to)
-            self._d_type = dt_to
-            self._bytes_up_to_date = False
-        else:
-            dt_to = np.dtype(f"f{sample_width}")
-            i = np.iinfo(self._d_type)
-            self._nparray = (self.nparray().astype(dt_to) / abs(i.min)).clip(-1.0, 1.0)
-            self._d_type = dt_to
-            self._bytes_up_to_date = False
+    def root_mean_square_energy(self) -> float:
+        return self.mean_square_energy() ** 0.5
 
-    def to_int(self, sample_width: int = 2) -> None:
-        if not self.using_float() and self.sample_width() == sample_width:
-            return
-        elif not self.using_float():
-            self.to_float(8)
-            self.to_int(sample_width)
-        else:
-            dt_to = np.dtype(f"i{sample_width}")
-            i = np.iinfo(dt_to)
-            self._nparray = (self.nparray() * abs(i.min)).clip(i.min, i.max).astype(dt_to)
-            self._d_type = dt_to
-            self._bytes_up_to_date = False
+    def peak(self) -> float:
+        return float(self.statistics().peak[0]) if self.frames() else 0.0
 
-    def to_d_type(self, d_type: np.dtype) -> None:
-        if d_type.kind == "f":
-            self.to_float(d_type.alignment)
-        else:
-            assert d_type.kind == "i"
-            self.to_int(d_type.alignment)
+    def dc_offset(self) -> float:
+        return float(self.statistics().dc_offset[0]) if self.frames() else 0.0
+
+    def zero_crossing_rate(self) -> float:
+        return float(self.statistics().zero_crossing_rate[0]) if self.frames() else 0.0
+
+    def to_float(self, sample_width: int = None) -> None:
+        self.to_d_type(np.dtype(f"f{sample_width or Conversion.WORKING_SAMPLE_WIDTH}"))
+
+    def to_int(self, sample_width: int = 2, dither: bool = False) -> None:
+        self.to_d_type(np.dtype(f"i{sample_width}"), dither)
+
+    def to_d_type(self, d_type: np.dtype, dither: bool = False) -> None:
+        assert d_type.kind in "fi"
+        if d_type == self._d_type:
+            return
+        self._nparray = Conversion.convert(self.nparray(), d_type, dither)
+        self._d_type = d_type
+        self._changed()
 
     def split(self, after_frame) -> Tuple[Any, Any]:
         front, tail = np.split(self.nparray(), [after_frame])
-        return Chunk(nparray=front), Chunk(nparray=tail)
+        return Chunk(nparray=front, storage=self._storage), Chunk(nparray=tail, storage=self._storage)
 
     def append(self, other: Any) -> None:
         assert isinstance(other, Chunk)
         self._nparray = np.concatenate((self.nparray(), other.nparray()))
-        self._bytes_up_to_date = False
+        self._changed()
 
     def fill_with_zeros(self, target_size) -> None:
         missing_fields: int = target_size - self.frames()
@@ -130,7 +163,7 @@ class Chunk:
             assert isinstance(other, int) or isinstance(other, float)
             result._nparray = result.nparray() + other
 
-        result._bytes_up_to_date = False
+        result._changed()
         return result
 
     def __mul__(self, other: Any):
@@ -145,7 +178,7 @@ class Chunk:
             assert isinstance(other, int) or isinstance(other, float)
             result._nparray = result.nparray() * other
 
-        result._bytes_up_to_date = False
+        result._changed()
         return result
 
     def __truediv__(self, other: Any):
@@ -160,5 +193,5 @@ class Chunk:
             assert isinstance(other, int) or isinstance(other, float)
             result._nparray = result.nparray() / other
 
-        result._bytes_up_to_date = False
+        result._changed()
         return result
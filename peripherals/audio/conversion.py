@@ -0,0 +1,91 @@
+# External libs
+import numpy as np
+
+
+class Conversion:
+    """
+    Sample format conversions of whole arrays, each with at most one temporary array.
+
+    Integers are signed PCM, floats are in [-1.0, 1.0). Integer to integer conversions are exact bit shifts, float to
+    integer conversions round to the nearest value and can optionally add triangular (TPDF) dither.
+
+    Synthesis and processing compute in the float working format, integers are only used at the device and file
+    boundary. float32 halves the memory bandwidth compared to float64, set WORKING_SAMPLE_WIDTH to 8 for more precision.
+    """
+
+    WORKING_SAMPLE_WIDTH: int = 4
+
+    __random: np.random.Generator = np.random.default_rng()
+
+    @staticmethod
+    def working_d_type() -> np.dtype:
+        return np.dtype(f"f{Conversion.WORKING_SAMPLE_WIDTH}")
+
+    @staticmethod
+    def __bits(d_type: np.dtype) -> int:
+        return 8 * d_type.itemsize - 1
+
+    @staticmethod
+    def __tpdf_noise(size: int, d_type: np.dtype) -> np.ndarray:
+        """
+        :return: Triangular noise with an amplitude of one least significant bit
+        """
+        noise: np.ndarray = Conversion.__random.random(size, dtype=d_type)
+        noise -= Conversion.__random.random(size, dtype=d_type)
+        return noise
+
+    @staticmethod
+    def convert(samples: np.ndarray, d_type: np.dtype, dither: bool = False, in_place: bool = False) -> np.ndarray:
+        """
+        :param samples: Integer or float samples
+        :param d_type: The target type
+        :param dither: Add TPDF dither when reducing the resolution to integers
+        :param in_place: The samples may be overwritten, e.g. to scale float samples without a temporary array
+        :return: The converted samples. This may be samples itself if nothing needs to be done.
+        """
+        d_type = np.dtype(d_type)
+        source: np.dtype = samples.dtype
+        if source == d_type:
+            return samples
+
+        if source.kind == "f" and d_type.kind == "f":
+            return samples.astype(d_type)
+
+        if source.kind == "i" and d_type.kind == "f":
+            return np.multiply(samples, 1.0 / (1 << Conversion.__bits(source)), dtype=d_type)
+
+        if source.kind == "i" and d_type.kind == "i":
+            shift: int = Conversion.__bits(d_type) - Conversion.__bits(source)
+            if shift >= 0:
+                res: np.ndarray = samples.astype(d_type)
+                res <<= shift
+                return res
+
+            if dither:
+                noise: np.ndarray = Conversion.__tpdf_noise(len(samples), np.dtype(np.float32))
+                noise *= 1 << -shift
+                values: np.ndarray = np.add(samples, noise, dtype=np.float64)
+                values *= 1.0 / (1 << -shift)
+                return Conversion.__round_to_int(values, d_type)
+            return (samples >> -shift).astype(d_type)
+
+        assert source.kind == "f" and d_type.kind == "i"
+        scale: float = float(1 << Conversion.__bits(d_type))
+        if in_place and samples.flags.writeable and (d_type.itemsize <= 2 or source.itemsize == 8):
+            values: np.ndarray = samples
+            values *= scale
+        else:
+            values: np.ndarray = np.multiply(samples, scale, dtype=np.float64 if d_type.itemsize > 2 else source)
+        if dither:
+            values += Conversion.__tpdf_noise(len(values), values.dtype)
+        return Conversion.__round_to_int(values, d_type)
+
+    @staticmethod
+    def __round_to_int(values: np.ndarray, d_type: np.dtype) -> np.ndarray:
+        """
+        Rounds and clips float values in the scale of d_type in place, then casts them
+        """
+        limits: np.iinfo = np.iinfo(d_type)
+        np.rint(values, out=values)
+        np.clip(values, limits.min, limits.max, out=values)
+        return values.astype(d_type)
@@ -0,0 +1,12 @@
+from enum import Enum, auto
+
+
+class OutputChannel(Enum):
+    """
+    The named inputs of the mixing bus of an Output, in order of priority: each one is ducked while a channel before
+    it sounds.
+    """
+
+    SPEECH = auto()
+    EFFECTS = auto()
+    NOISE = auto()
@@ -1,7 +1,12 @@
 # External libs
-from pyaudio import PyAudio
+import numpy as np
+from pyaudio import PyAudio, Stream, paInt16
 
+from peripherals.audio.activity import Activity
 from peripherals.audio.audio import Audio
+from peripherals.audio.audio_stream import AudioStream
+from peripherals.audio.ring_buffer import RingBuffer
+from peripherals.audio.voice_activity_detector import VoiceActivityDetector
 
 # Internal libs
 from infra.resources_management.threaded_app import ThreadedApp
@@ -11,13 +16,29 @@ from typing import List, Tuple, Mapping
 import speech_recognition as sr
 from speech_recognition import Microphone, Recognizer
 from datetime import datetime, timedelta
-from queue import Queue
+from queue import Queue, Empty
 
 
 # TODO: Add average noise reset
 class Input(ThreadedApp):
+    """
+    Records utterances from the microphone into queue.
+
+    In continuous mode (the default), the microphone is read without gaps into a ring buffer, and a voice activity
+    detector finds the utterances in it. Every utterance starts with some pre-roll, so that word onsets are not clipped,
+    and ends once there was no speech for the endpointing latency. Otherwise, speech_recognition's listen is used.
+
+    recording is active while the microphone is switched on, see start_recording and stop_recording.
+    """
 
     CHUNK_SIZE: int = 4096
+    ENERGY_THRESHOLD: float = 200.0
+
+    __continuous: bool = None
+    __pre_roll: float = None
+    __endpointing: float = None
+    __max_utterance: float = None
+    __min_utterance: float = None
 
     __recognizer: Recognizer = None
     __record_flag: Event = None
@@ -36,8 +57,23 @@ class Input(ThreadedApp):
     __short_timeout: float = None
 
     queue: Queue[Tuple[datetime, Audio]] = None
-
-    def __init__(self, long_timeout: float = 10.0, short_timeout: float = 1.0):
+    recording: Activity = None
+
+    def __init__(self, long_timeout: float = 10.0, short_timeout: float = 1.0,
+                 continuous: bool = True,
+                 pre_roll: float = 0.3,
+                 endpointing_ms: int = 500,
+                 max_utterance: float = 30.0,
+                 min_utterance: float = 0.2):
+        """
+        :param long_timeout: Listening timeout without continuous mode, until something was heard
+        :param short_timeout: Listening timeout without continuous mode, right after something was heard
+        :param continuous: Capture continuously and detect utterances with the voice activity detector
+        :param pre_roll: Seconds of audio that are kept before the start of every utterance
+        :param endpointing_ms: Milliseconds without speech after which an utterance ends
+        :param max_utterance: Longer utterances are split, this also sets the size of the ring buffer
+        :param min_utterance: Shorter utterances (without pre-roll and endpointing) are discarded, e.g. clicks
+        """
         super().__init__()
 
         py_audio: PyAudio = PyAudio()
@@ -53,6 +89,11 @@ class Input(ThreadedApp):
 
         self.__long_timeout = long_timeout
         self.__short_timeout = short_timeout
+        self.__continuous = continuous
+        self.__pre_roll = pre_roll
+        self.__endpointing = endpointing_ms / 1000
+        self.__max_utterance = max_utterance
+        self.__min_utterance = min_utterance
         self.__short_timeout_count = 0
         self.__short_timeout_count_lock = Lock()
 
@@ -61,37 +102,58 @@ class Input(ThreadedApp):
         self.__listen_stop_timestamp_lock = Lock()
         self.__recognizer = Recognizer()
         self.__record_flag = Event()
+        self.recording = Activity()
 
         self.queue = Queue()
         self.__queue_lock = Lock()
 
-        self._make_thread(self.__input_loop)
+        self._make_thread(self.__capture_loop if continuous else self.__input_loop)
 
     def stop_recording(self) -> None:
         if self.__record_flag.is_set():
             with self.__listen_stop_timestamp_lock:
                 self.__listen_stop_timestamp = datetime.now()
                 self.__record_flag.clear()
+            self.recording.set(False)
 
     def start_recording(self) -> None:
         self.__record_flag.set()
         with self.__listen_stop_timestamp_lock:
             self.__listen_stop_timestamp = None
+        self.recording.set(True)
 
     def is_recording(self) -> bool:
         """
         This is an approximation: It actually indicates whether we have been recording for a sufficiently long time,
         i.e. for longer than the timeout of the corresponding listening attempt.
+        In continuous mode, it indicates whether an utterance is in progress.
         :return: True if we are sure we are recording, else False.
         """
         audio_timestamp: datetime = self.__timestamp_thread_safe
         now_timestamp: datetime = datetime.now()
         if not audio_timestamp:
             return False
+        if self.__continuous:
+            return True
 
         timeout: float = self.__short_timeout if self.__short_timeout_count else self.__long_timeout
         return audio_timestamp + timedelta(seconds=timeout) < now_timestamp
 
+    def stream(self, queue_timeout: float = 0.5) -> AudioStream:
+        """
+        Microphone source: Streams the chunks of all recorded utterances, until the input is closed.
+        Blocks until the first utterance is recorded, since it determines the format.
+        """
+        def audios():
+            while not self.was_closed:
+                try:
+                    _, audio = self.queue.get(timeout=queue_timeout)
+                    yield audio
+                except Empty:
+                    continue
+
+        return AudioStream.from_audios(audios())
+
     def start(self) -> None:
         super().start()
         self.start_recording()
@@ -171,6 +233,90 @@ class Input(ThreadedApp):
                 self._logger.debug(f"Recorded {audio.seconds():.1f} seconds of audio.")
                 self.__short_timeout_count_thread_safe = 3
 
+    def __capture_loop(self) -> None:
+        frame_rate: int = int(self.__mic_info['defaultSampleRate'])
+        detector: VoiceActivityDetector = VoiceActivityDetector(frame_rate,
+                                                                energy_threshold=self.ENERGY_THRESHOLD,
+                                                                hangover=self.__endpointing)
+        block_size: int = detector.frame_size * max(self.CHUNK_SIZE // detector.frame_size, 1)
+        pre_roll: int = int(self.__pre_roll * frame_rate)
+        max_utterance: int = int(self.__max_utterance * frame_rate)
+        # Utterances are only split once the block that reaches the maximum length has been written
+        ring: RingBuffer = RingBuffer(max_utterance + pre_roll + block_size)
+        min_utterance: int = int((self.__min_utterance + self.__endpointing) * frame_rate)
+
+        # Absolute sample index in the ring buffer where the current utterance started
+        utterance_start: int | None = None
+        # Whether the current utterance continues one that was split, instead of starting at the speech onset
+        utterance_continued: bool = False
+
+        def emit(speech_start: int, stop: int, continued: bool) -> None:
+            # A continuation already follows the previous segment seamlessly, pre-roll would repeat its end
+            start: int = max(speech_start if continued else speech_start - pre_roll, ring.start)
+            if stop - speech_start < min_utterance:
+                self._logger.debug("Discarded short utterance")
+                return
+            audio: Audio = Audio(chunks=ring.read(start, stop),
+                                 channels=1,
+                                 sample_width=2,
+                                 frame_rate=frame_rate,
+                                 chunk_size=self.CHUNK_SIZE)
+            self.queue.put((datetime.now() - timedelta(seconds=(ring.end - start) / frame_rate), audio))
+            self._logger.debug(f"Recorded {audio.seconds():.1f} seconds of audio.")
+
+        def split(position: int) -> None:
+            """
+            Emits the maximum length of the current utterance as long as it reaches position
+            """
+            nonlocal utterance_start, utterance_continued
+            while utterance_start is not None and position - utterance_start >= max_utterance:
+                emit(utterance_start, utterance_start + max_utterance, utterance_continued)
+                utterance_start += max_utterance
+                utterance_continued = True
+
+        py_audio: PyAudio = PyAudio()
+        stream: Stream = py_audio.open(format=paInt16,
+                                       channels=1,
+                                       rate=frame_rate,
+                                       input=True,
+                                       input_device_index=self.__mic_info['index'],
+                                       frames_per_buffer=block_size)
+        try:
+            while not self.was_closed:
+                samples: np.ndarray = np.frombuffer(stream.read(block_size, exception_on_overflow=False),
+                                                    dtype=np.int16)
+                block_start: int = ring.end
+                ring.write(samples)
+                active: np.ndarray = detector.detect(samples)
+
+                if not self.__record_flag.is_set():
+                    # Drop whatever is in progress, e.g. because we are talking ourselves
+                    utterance_start = None
+                    self.__timestamp_thread_safe = None
+                    detector.reset()
+                    continue
+
+                # Frames where the activity changes, an utterance starts at a rising and ends at a falling edge
+                previous: bool = utterance_start is not None
+                edges: np.ndarray = np.flatnonzero(np.diff(active, prepend=previous))
+                for edge in edges:
+                    position: int = block_start + int(edge) * detector.frame_size
+                    split(position)
+                    if active[edge]:
+                        utterance_start = position
+                        utterance_continued = False
+                        self.__timestamp_thread_safe = datetime.now()
+                    else:
+                        emit(utterance_start, position, utterance_continued)
+                        utterance_start = None
+                        self.__timestamp_thread_safe = None
+
+                split(ring.end)
+        finally:
+            stream.stop_stream()
+            stream.close()
+            py_audio.terminate()
+
 
 if __name__ == '__main__':
     from infra.log.setup import LoggingSetup
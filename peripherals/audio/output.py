@@ -1,108 +1,449 @@
 # External libs
-from pyaudio import PyAudio, Stream
+import numpy as np
+from pyaudio import PyAudio, Stream, paContinue, paOutputUnderflow
 
+from peripherals.audio.activity import Activity
 from peripherals.audio.audio import Audio
+from peripherals.audio.audio_stream import AudioStream
+from peripherals.audio.bus_channel import BusChannel
+from peripherals.audio.conversion import Conversion
+from peripherals.audio.enums.output_channel import OutputChannel
+from peripherals.audio.playback import Playback
+from peripherals.audio.ring_buffer import RingBuffer
 
 # Internal libs
 from infra.resources_management.threaded_app import ThreadedApp
-from threading import Lock, Event
-from typing import List, Dict, Tuple
+from collections import deque
+from datetime import datetime, timedelta
+from threading import Lock, Event, Condition
+from time import monotonic
+from typing import List, Dict, Tuple, Deque
 
 
 class Output(ThreadedApp):
+    """
+    Plays audio on the default output device, through a mixing bus with one channel per OutputChannel. Audio objects
+    are converted to the working format at the device frame rate once, when they are queued.
+
+    A producer thread mixes all channels block by block, each at its own gain and ducked while a channel of higher
+    priority sounds, and copies the mix into a preallocated ring buffer up to the target latency ahead of the device.
+    The device stream runs in callback mode, and the callback only copies one block out of the ring buffer. Blocks the
+    ring buffer could not fill while audio was due are padded with silence and counted as underruns.
+
+    Background channels (noise) keep playing while the output is paused. activity is active from the moment something
+    is queued on another channel until it has been played by the device.
+
+    Cancelling playbacks rewinds the mix to one block after the one the device is playing: the ring buffer is cut
+    there, and every channel mixes its samples from there on again, without the cancelled playbacks. So cancelled
+    audio stops within one device block, while all other audio continues seamlessly.
+
+    The playback clock counts the frames the device has consumed. Every callback anchors it to the time the device will
+    play its block, so that every Playback gets the times its first and last frame are actually played.
+    """
+
+    sample_width: int = None
+    channels: int = None
+    frame_rate: int = None
+    target_latency: float = None
+    frames_per_buffer: int = None
+
+    activity: Activity = None
+
+    # Callbacks that had to pad with silence while audio was due, and the number of padded frames
+    underruns: int = None
+    underrun_frames: int = None
+    # Callbacks for which the device reported an underflow itself
+    device_underruns: int = None
+
+    QUEUE_LATENCY_HISTORY: int = 32
 
     __py_audio: PyAudio = None
+    __stream: Stream = None
 
-    __queue: List[Audio] = None
+    __bus: Dict[OutputChannel, BusChannel] = None
     __queue_lock: Lock = None
     __play_flag: Event = None
+    # Set whenever there might be something new to mix
+    __wake: Event = None
+
+    __mix: np.ndarray = None
+    __ramp: np.ndarray = None
+
+    # Number of rewinds requested by cancel, and number of rewinds done by the output loop
+    __rewinds_requested: int = None
+    __rewinds_done: int = None
+    __rewound: Condition = None
+    __started: bool = None
+    # Absolute index the mix was last cut at
+    __cut_position: int = None
 
-    __streams: Dict[Tuple[int, int, int], Stream] = None
+    # Frames the device has requested, including silence, only counted by the callback
+    __device_frames: int = None
+    # (absolute index, monotonic time the device plays it) of the last callback
+    __anchor: Tuple[int, float] = None
+    # Queue latencies of the last foreground playbacks
+    __queue_latencies: Deque[float] = None
 
-    def __init__(self):
+    __ring: RingBuffer = None
+    # Absolute index of the next sample for the device, only moved by the callback
+    __read_position: int = None
+    # Absolute index behind the last mixed sample of a foreground channel
+    __foreground_end: int = None
+    # Whether the producer has audio that is due, i.e. missing samples are an underrun
+    __due: bool = None
+    __consumed: Event = None
+    __block: np.ndarray = None
+
+    def __init__(self, sample_width: int = 2, channels: int = Audio.DEFAULT_CHANNELS,
+                 frame_rate: int = Audio.DEFAULT_FRAME_RATE,
+                 target_latency: float = 0.1,
+                 frames_per_buffer: int = 512):
+        """
+        :param target_latency: Seconds of audio the producer keeps buffered ahead of the device
+        :param frames_per_buffer: Frames the device requests per callback, and frames mixed per block
+        """
         super().__init__()
 
-        self.__queue = []
+        self.sample_width = sample_width
+        self.channels = channels
+        self.frame_rate = frame_rate
+        self.target_latency = target_latency
+        self.frames_per_buffer = frames_per_buffer
+
         self.__queue_lock = Lock()
         self.__play_flag = Event()
+        self.__wake = Event()
+        self.__rewinds_requested = 0
+        self.__rewinds_done = 0
+        self.__rewound = Condition(self.__queue_lock)
+        self.__started = False
+        self.__cut_position = 0
+        self.__device_frames = 0
+        self.__anchor = (0, monotonic())
+        self.__queue_latencies = deque(maxlen=self.QUEUE_LATENCY_HISTORY)
+        self.activity = Activity()
+
+        self.underruns = 0
+        self.underrun_frames = 0
+        self.device_underruns = 0
+
+        self.__mix = np.zeros(frames_per_buffer * channels, dtype=Conversion.working_d_type())
+        self.__ramp = np.arange(1, frames_per_buffer + 1, dtype=Conversion.working_d_type()) / frames_per_buffer
+
+        d_type: np.dtype = np.dtype(f"{'f' if Audio._using_float_convention(sample_width) else 'i'}{sample_width}")
+        latency_frames: int = max(round(target_latency * frame_rate), 2 * frames_per_buffer)
+        # Every channel buffers about as much as the ring buffer holds, its streams are pulled on their own threads
+        read_ahead: int = latency_frames * channels
+        self.__bus = {
+            OutputChannel.SPEECH: BusChannel(OutputChannel.SPEECH, self.__queue_lock, read_ahead, self.__wake.set),
+            OutputChannel.EFFECTS: BusChannel(OutputChannel.EFFECTS, self.__queue_lock, read_ahead, self.__wake.set,
+                                              ducking=0.5),
+            OutputChannel.NOISE: BusChannel(OutputChannel.NOISE, self.__queue_lock, read_ahead, self.__wake.set,
+                                            ducking=0.3, background=True),
+        }
+        self.__ring = RingBuffer(latency_frames * channels, d_type)
+        self.__read_position = 0
+        self.__foreground_end = 0
+        self.__due = False
+        self.__consumed = Event()
+        self.__block = np.zeros(frames_per_buffer * channels, dtype=d_type)
 
-        self.__streams = {}
         self.__py_audio = PyAudio()
+        self.__stream = self.__py_audio.open(
+            format=self.__py_audio.get_format_from_width(sample_width),
+            channels=channels,
+            rate=frame_rate,
+            output=True,
+            frames_per_buffer=frames_per_buffer,
+            stream_callback=self.__callback,
+            start=False
+        )
 
         self._make_thread(self.__output_loop)
 
+    def bus(self, channel: OutputChannel) -> BusChannel:
+        """
+        :return: The channel of the mixing bus, e.g. to change its gain or ducking
+        """
+        return self.__bus[channel]
+
     def stop_playing(self):
+        """
+        Pauses all foreground channels, background channels keep playing
+        """
         self.__play_flag.clear()
 
     def start_playing(self):
         self.__play_flag.set()
+        self.__wake.set()
 
     def active(self):
+        return self.activity.is_active()
+
+    def clock(self) -> float:
+        """
+        :return: Monotonic playback clock: seconds of audio the device has consumed, including silence
+        """
+        return self.__device_frames / self.frame_rate
+
+    def queue_latency(self) -> float | None:
+        """
+        :return: Mean seconds from queueing to playing the first frame, over the last foreground playbacks
+        """
+        latencies: List[float] = list(self.__queue_latencies)
+        return sum(latencies) / len(latencies) if latencies else None
+
+    def __time_of(self, position: int) -> datetime:
+        """
+        :param position: Absolute index in the output
+        :return: The time the device plays the sample at position
+        """
+        anchor_position, anchor_time = self.__anchor
+        seconds: float = anchor_time + (position - anchor_position) / self.channels / self.frame_rate - monotonic()
+        return datetime.now() + timedelta(seconds=seconds)
+
+    def buffered(self) -> int:
+        """
+        :return: Number of frames in the ring buffer that the device has not played yet
+        """
+        return (self.__ring.end - self.__read_position) // self.channels
+
+    def clear(self, channel: OutputChannel | None = None) -> None:
+        """
+        Cancels everything on the channel, on all foreground channels if None. Background channels like the noise only
+        stop if they are cleared explicitly, since their sources usually queue their endless stream only once.
+        """
+        if channel is None:
+            self.__cancel(None, [bus_channel for bus_channel in self.__bus.values() if not bus_channel.background])
+        else:
+            self.__cancel(None, [self.__bus[channel]])
+
+    def cancel(self, tag: str | None = None, channel: OutputChannel | None = None, timeout: float = 1.0) -> int:
+        """
+        Stops the matching playbacks within one device block, whether they are playing or still queued
+        :param tag: Only cancel the playbacks with this tag, all if None
+        :param channel: Only cancel playbacks on this channel, all if None
+        :param timeout: Seconds to wait for the output loop to rewind the mix, e.g. if it waits for a slow stream
+        :return: Frames of the cancelled playbacks that were played, and finishes their playback handles
+        """
+        return self.__cancel(tag, list(self.__bus.values()) if channel is None else [self.__bus[channel]], timeout)
+
+    def __cancel(self, tag: str | None, bus_channels: List[BusChannel], timeout: float = 1.0) -> int:
+        with self.__queue_lock:
+            cancelled: List[Playback] = []
+            for bus_channel in bus_channels:
+                cancelled += bus_channel.cancel(tag)
+            if not cancelled:
+                return 0
+
+            self._logger.debug(f"Cancelling {len(cancelled)} playbacks")
+            self.__rewinds_requested += 1
+            requested: int = self.__rewinds_requested
+            self.__wake.set()
+            rewound: bool = self.__started and self.__rewound.wait_for(
+                lambda: self.__rewinds_done >= requested or self.was_closed, timeout)
+            if not self.__foreground_active():
+                self.activity.set(False)
+
+        # Outside the lock, since the callbacks of the playbacks may queue something new
+        finished: datetime = self.__time_of(self.__cut_position) if rewound else datetime.now()
+        for playback in cancelled:
+            playback._finish(finished)
+        return sum(playback.frames_played for playback in cancelled)
+
+    def play(self, audio: Audio | AudioStream, prioritise: bool = False, channel: OutputChannel = OutputChannel.SPEECH,
+             tag: str | None = None) -> Playback:
+        """
+        :param audio: Complete audio, or a stream that is only read as fast as it is played. Streams are converted to
+                      the device format chunk by chunk, with a resampler that carries its state across chunks.
+        :param prioritise: Play before everything else that is queued on the channel
+        :param channel: The channel of the mixing bus
+        :param tag: Groups playbacks for cancel, e.g. everything spoken for one task
+        :return: A handle to cancel the audio and see how much of it was played
+        """
+        if isinstance(audio, Audio):
+            audio = audio.copy()
+            audio.to_device_format(Conversion.WORKING_SAMPLE_WIDTH, True, self.channels, self.frame_rate)
+            audio = AudioStream.from_audio(audio)
+        else:
+            audio = audio.to_device_format(Conversion.WORKING_SAMPLE_WIDTH, True, self.channels, self.frame_rate)
+
+        playback: Playback = Playback(audio, channel, tag)
         with self.__queue_lock:
-            return bool(self.__queue)
+            self._logger.debug(f"Adding audio to {channel.name.lower()} queue {'start' if prioritise else 'end'}")
+            self.__bus[channel].queue(playback, prioritise)
+            # Under the queue lock, so that it is in line with the queues
+            if not self.__bus[channel].background:
+                self.activity.set(True)
+        self.__wake.set()
+        return playback
+
+    def __foreground_active(self) -> bool:
+        """
+        Has to be called with the queue lock held
+        """
+        return any(channel.active() for channel in self.__bus.values() if not channel.background)
+
+    def __mix_block(self) -> Tuple[bool, bool]:
+        """
+        Mixes the next block of all channels into self.__mix, in order of priority
+        :return: Whether any channel, and whether any foreground channel contributed
+        """
+        self.__mix[:] = 0
+        playing: bool = self.__play_flag.is_set()
+        contributed: bool = False
+        foreground: bool = False
+        for channel in self.__bus.values():
+            if not channel.background and not playing:
+                continue
+            if channel.mix_into(self.__mix, self.__ring.end, self.channels, contributed, self.__ramp):
+                contributed = True
+                foreground |= not channel.background
+        return contributed, foreground
+
+    def __wait_for_device(self) -> None:
+        """
+        Waits until the device consumed a block, or for at most one block if it is not running
+        """
+        self.__consumed.wait(self.frames_per_buffer / self.frame_rate)
 
-    def clear(self):
+    def __write(self, samples: np.ndarray) -> None:
+        """
+        Copies the samples into the ring buffer, as soon as the device has made space for them
+        """
+        offset: int = 0
+        while offset < len(samples) and not self.was_closed and not self.__rewind_requested():
+            self.__consumed.clear()
+            free: int = self.__ring.capacity - (self.__ring.end - self.__read_position)
+            if not free:
+                self.__wait_for_device()
+                continue
+            self.__ring.write(samples[offset:offset + free])
+            offset += free
+
+    def __rewind_requested(self) -> bool:
+        return self.__rewinds_done != self.__rewinds_requested
+
+    def __rewind(self) -> None:
+        """
+        Cuts the ring buffer after the block the device may be reading right now, and lets every channel mix its samples
+        from there on again
+        """
         with self.__queue_lock:
-            self.__queue.clear()
+            requested: int = self.__rewinds_requested
+
+        position: int = min(self.__read_position + self.frames_per_buffer * self.channels, self.__ring.end)
+        # The device may have read on meanwhile, then the cut moves behind what it read
+        position = max(position, min(self.__read_position, self.__ring.end))
+        self.__ring.truncate(position)
+        for channel in self.__bus.values():
+            self.__record_queue_latencies(channel.rewind(position, self.channels, self.__time_of))
+        self.__foreground_end = min(self.__foreground_end, position)
+        self.__cut_position = position
 
-    def play(self, audio: Audio, prioritise: bool = False):
         with self.__queue_lock:
-            self._logger.debug(f"Adding audio to queue {'start' if prioritise else 'end'}")
-            self.__queue.insert(0 if prioritise else len(self.__queue), audio)
+            self.__rewinds_done = requested
+            self.__rewound.notify_all()
+
+    def __record_queue_latencies(self, started: List[Playback]) -> None:
+        for playback in started:
+            if not self.__bus[playback.channel].background:
+                self.__queue_latencies.append(playback.queue_latency())
 
-    def __chunk(self):
+    def __update_activity(self) -> bool:
+        """
+        :return: Whether the output is still active, i.e. foreground audio is queued or not played yet
+        """
         with self.__queue_lock:
-            while self.__queue:
-                if not self.__queue[0].chunks:
-                    self.__queue.pop()
+            if self.__foreground_active() or self.__read_position < self.__foreground_end:
+                return True
+            self.activity.set(False)
+            return False
+
+    def __output_loop(self) -> None:
+        d_type: np.dtype = self.__block.dtype
+        while not self.was_closed:
+            self.__wake.clear()
+            if self.__rewind_requested():
+                self.__rewind()
+            for channel in self.__bus.values():
+                self.__record_queue_latencies(channel.retire(self.__read_position, self.channels, self.__time_of))
+
+            contributed, foreground = self.__mix_block()
+            if not contributed:
+                self.__due = False
+                # Waits for the device to play the rest, else for something new to mix
+                if self.__update_activity() or any(channel.mixed() for channel in self.__bus.values()):
+                    self.__wait_for_device()
                 else:
-                    return self.__queue[0].pop()
-            return None
+                    self.__wake.wait(self.target_latency)
+                continue
+
+            self.__due = True
+            self.__write(Conversion.convert(self.__mix, d_type, in_place=True))
+            if foreground:
+                self.__foreground_end = self.__ring.end
+            self.__update_activity()
 
-    def __get_stream(self, sample_width: int, channels: int, frame_rate: int) -> Stream:
+    def __callback(self, in_data: bytes | None, frame_count: int, time_info: dict, status_flags: int) \
+            -> Tuple[bytes, int]:
         """
-        This is not efficient if there are many formats, but the caller can standardise the input if they want
-        :param sample_width: Width of each frame in bytes
-        :param channels: Number of channels
-        :param frame_rate: Frames per second
-        :return: An output stream that works for audio corresponding to the input parameters
+        Runs on the audio thread for every block: copies it out of the ring buffer without locking or allocating
         """
-        key: Tuple[int, int, int] = (sample_width, channels, frame_rate)
-        if key not in self.__streams:
-            stream: Stream = self.__py_audio.open(
-                format=self.__py_audio.get_format_from_width(sample_width),
-                channels=channels,
-                rate=frame_rate,
-                output=True
-            )
-            self.__streams[key] = stream
+        if status_flags & paOutputUnderflow:
+            self.device_underruns += 1
 
-        return self.__streams[key]
+        # Anchors the playback clock: this block is played after the latency of the device
+        device_latency: float = max(time_info.get("output_buffer_dac_time", 0.0) - time_info.get("current_time", 0.0),
+                                    0.0)
+        self.__anchor = (self.__read_position, monotonic() + device_latency)
+        self.__device_frames += frame_count
 
-    def __play(self, audio: Audio) -> None:
-        audio.to_standard_width()
+        samples: int = frame_count * self.channels
+        if len(self.__block) < samples:
+            self.__block = np.zeros(samples, dtype=self.__block.dtype)
+        block: np.ndarray = self.__block[:samples]
 
-        stream: Stream = self.__get_stream(audio.sample_width, audio.channels, audio.frame_rate)
-        for chunk in audio.chunks:
-            stream.write(chunk.tobytes())
+        # The output loop may truncate the ring buffer at any time, so everything is clamped to one reading of its end. If
+        # it cut behind the read position, continues with what it mixes there.
+        end: int = self.__ring.end
+        if end < self.__read_position:
+            self.__read_position = end
 
-    def __output_loop(self) -> None:
-        while not self.was_closed:
-            self.__play_flag.wait()
-            audio_chunk: Audio = self.__chunk()
-            if audio_chunk:
-                self.__play(audio_chunk)
+        available: int = min(end - self.__read_position, samples)
+        if available:
+            self.__ring.read_unchecked(self.__read_position, block[:available])
+            self.__read_position += available
+        if available < samples and self.__due:
+            self.underruns += 1
+            self.underrun_frames += (samples - available) // self.channels
+
+        block[available:] = 0
+        self.__consumed.set()
+        return block.tobytes(), paContinue
 
     def start(self) -> None:
         super().start()
+        for channel in self.__bus.values():
+            channel.start()
+        self.__started = True
+        self.__stream.start_stream()
         self.start_playing()
 
     def close(self) -> None:
+        # Wakes up the output loop before super().close() joins it
+        self._was_closed.set()
+        self.__wake.set()
+        with self.__queue_lock:
+            self.__rewound.notify_all()
         super().close()
-        self.start_playing()  # to get out of potential lock wait deadlock
-        stream: Stream
-        for _, stream in self.__streams.items():
-            stream.close()
+        # Finishes the handles of everything that was not played, without waiting for the stopped output loop
+        self.__started = False
+        self.cancel()
+        for channel in self.__bus.values():
+            channel.close()
+        self.__stream.stop_stream()
+        self.__stream.close()
         self.__py_audio.terminate()
 
 
@@ -111,9 +452,10 @@ if __name__ == '__main__':
     LoggingSetup(override_level=LoggingSetup.DEBUG)
 
     from os.path import join, realpath, pardir, dirname
-    from time import sleep
 
     obj: Audio = Audio(wav_filename=join(realpath(dirname(__file__)), pardir, pardir, "files", "tests", "bam.wav"))
     with Output() as output:
-        output.play(obj)
-        sleep(obj.seconds())
+        playback: Playback = output.play(obj)
+        playback.wait()
+        print(f"Played from {playback.started:%H:%M:%S.%f} to {playback.finished:%H:%M:%S.%f}, "
+              f"{output.underruns} underruns ({output.underrun_frames} frames)")
@@ -0,0 +1,102 @@
+# Internal libs
+from peripherals.audio.audio_stream import AudioStream
+from peripherals.audio.enums.output_channel import OutputChannel
+
+# General utilities
+from datetime import datetime
+from threading import Event, Lock, Thread
+from typing import List, Callable, Any
+
+
+class Playback:
+    """
+    A handle for audio queued on an Output, e.g. to cancel it by its tag, to see how much of it was played, and to wait
+    for it to finish.
+
+    started and finished are the times the device played the first and the last frame, taken from the playback clock
+    of the output, not from when the audio was queued. A cancelled playback finishes where it was cut off.
+    """
+
+    stream: AudioStream = None
+    channel: OutputChannel = None
+    tag: str | None = None
+
+    queued: datetime = None
+    started: datetime | None = None
+    finished: datetime | None = None
+
+    # Frames the device has played, or will play before a cancellation takes effect
+    frames_played: int = None
+    cancelled: bool = None
+
+    __done: Event = None
+    __callbacks: List[Callable[[Any], None]] = None
+    __callbacks_lock: Lock = None
+
+    def __init__(self, stream: AudioStream, channel: OutputChannel, tag: str | None = None):
+        self.stream = stream
+        self.channel = channel
+        self.tag = tag
+        self.queued = datetime.now()
+        self.frames_played = 0
+        self.cancelled = False
+
+        self.__done = Event()
+        self.__callbacks = []
+        self.__callbacks_lock = Lock()
+
+    def seconds_played(self) -> float:
+        return self.frames_played / self.stream.frame_rate
+
+    def queue_latency(self) -> float | None:
+        """
+        :return: Seconds from queueing to the first frame being played, None if it has not started
+        """
+        return (self.started - self.queued).total_seconds() if self.started else None
+
+    def done(self) -> bool:
+        return self.__done.is_set()
+
+    def wait(self, timeout: float = None) -> bool:
+        """
+        :return: True once the playback finished or was cancelled, False if the timeout expired before
+        """
+        return self.__done.wait(timeout)
+
+    def add_done_callback(self, callback: Callable[[Any], None]) -> None:
+        """
+        :param callback: Called with this playback once it finished or was cancelled, right away if it already is. It
+                         runs on a thread of its own, so it may use the output, e.g. to play or cancel something.
+        """
+        with self.__callbacks_lock:
+            if not self.__done.is_set():
+                self.__callbacks.append(callback)
+                return
+        self.__run([callback])
+
+    def __run(self, callbacks: List[Callable[[Any], None]]) -> None:
+        def run() -> None:
+            for callback in callbacks:
+                callback(self)
+
+        # Not on the thread that finishes the playback, which is usually the mixing thread of the output
+        Thread(target=run, name="Thread 'playback_callbacks'").start()
+
+    def _start(self, timestamp: datetime) -> None:
+        if self.started is None:
+            self.started = timestamp
+
+    def _finish(self, timestamp: datetime) -> None:
+        """
+        Called by the output once, when the device has played the last frame or the playback was cancelled
+        """
+        with self.__callbacks_lock:
+            if self.__done.is_set():
+                return
+            self.finished = timestamp
+            self.__done.set()
+            callbacks: List[Callable[[Any], None]] = self.__callbacks
+            self.__callbacks = []
+
+        if callbacks:
+            self.__run(callbacks)
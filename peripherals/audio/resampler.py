@@ -0,0 +1,91 @@
+# External libs
+import numpy as np
+from scipy.signal import firwin
+
+# General utilities
+from fractions import Fraction
+
+
+class Resampler:
+    """
+    Polyphase resampling of a signal that arrives in chunks, with the same filter as scipy's resample_poly.
+
+    The filter history and the position of the next output frame are carried across chunks, so the result equals
+    resampling the whole signal at once: there are no transients at the chunk edges and the length does not drift.
+    flush() returns the rest of the signal once it ended.
+    """
+
+    channels: int = None
+    up: int = None
+    down: int = None
+
+    # Filter taps per phase of the up-sampled signal, i.e. __phases[p][m] is h[p + m * up]
+    __phases: np.ndarray = None
+    # Input frames from the absolute index __history_start on, older ones are not needed anymore
+    __history: np.ndarray = None
+    __history_start: int = None
+    __received: int = None
+    # Outputs before this one only consist of the filter delay
+    __first_output: int = None
+    __next_output: int = None
+
+    def __init__(self, from_rate: int, to_rate: int, channels: int):
+        ratio: Fraction = Fraction(to_rate, from_rate)
+        self.channels = channels
+        self.up = ratio.numerator
+        self.down = ratio.denominator
+
+        # The design of resample_poly, including the padding that compensates the delay of the filter
+        max_rate: int = max(self.up, self.down)
+        half_length: int = 10 * max_rate
+        pre_padding: int = self.down - half_length % self.down
+        taps: np.ndarray = firwin(2 * half_length + 1, 1.0 / max_rate, window=("kaiser", 5.0)) * self.up
+        taps_per_phase: int = -(-(pre_padding + len(taps)) // self.up)
+        padded: np.ndarray = np.zeros(taps_per_phase * self.up)
+        padded[pre_padding:pre_padding + len(taps)] = taps
+        self.__phases = padded.reshape(taps_per_phase, self.up).T
+
+        # The signal counts as zero before its start
+        self.__history = np.zeros((taps_per_phase - 1, channels))
+        self.__history_start = 1 - taps_per_phase
+        self.__received = 0
+        self.__first_output = (half_length + pre_padding) // self.down
+        self.__next_output = self.__first_output
+
+    def process(self, frames: np.ndarray) -> np.ndarray:
+        """
+        :param frames: The next input frames, shaped (frames, channels)
+        :return: All output frames that only depend on the input so far, shaped (frames, channels)
+        """
+        self.__history = np.concatenate((self.__history, frames))
+        self.__received += len(frames)
+        return self.__outputs((self.__received * self.up - 1) // self.down)
+
+    def flush(self) -> np.ndarray:
+        """
+        :return: The remaining output frames at the end of the signal
+        """
+        last: int = self.__first_output - (-self.__received * self.up // self.down) - 1
+        missing: int = (last * self.down) // self.up + 1 - (self.__history_start + len(self.__history))
+        if missing > 0:
+            self.__history = np.concatenate((self.__history, np.zeros((missing, self.channels))))
+        return self.__outputs(last)
+
+    def __outputs(self, last: int) -> np.ndarray:
+        """
+        :param last: Absolute index of the last output frame to compute
+        """
+        outputs: np.ndarray = np.arange(self.__next_output, last + 1)
+        if not len(outputs):
+            return np.zeros((0, self.channels))
+
+        positions: np.ndarray = outputs * self.down
+        taps_per_phase: int = self.__phases.shape[1]
+        inputs: np.ndarray = (positions // self.up)[:, np.newaxis] - np.arange(taps_per_phase) - self.__history_start
+        res: np.ndarray = np.einsum("ot,otc->oc", self.__phases[positions % self.up], self.__history[inputs])
+
+        self.__next_output = last + 1
+        keep_from: int = (self.__next_output * self.down) // self.up - (taps_per_phase - 1)
+        self.__history = self.__history[keep_from - self.__history_start:]
+        self.__history_start = keep_from
+        return res
@@ -0,0 +1,77 @@
+# External libs
+import numpy as np
+
+
+class RingBuffer:
+    """
+    A fixed-size buffer of the most recently written samples.
+
+    Samples are addressed by their absolute index, i.e. the number of samples written before them. Only the last
+    capacity samples can be read, older ones are overwritten. Writing and reading copy at most two slices.
+    """
+
+    capacity: int = None
+    end: int = None
+
+    __buffer: np.ndarray = None
+
+    def __init__(self, capacity: int, d_type: np.dtype = np.int16):
+        assert capacity > 0
+        self.capacity = capacity
+        self.end = 0
+        self.__buffer = np.zeros(capacity, dtype=d_type)
+
+    @property
+    def start(self) -> int:
+        """
+        :return: Absolute index of the oldest sample that can still be read
+        """
+        return max(self.end - self.capacity, 0)
+
+    def write(self, samples: np.ndarray) -> None:
+        if len(samples) > self.capacity:
+            self.end += len(samples) - self.capacity
+            samples = samples[-self.capacity:]
+
+        position: int = self.end % self.capacity
+        first: int = min(len(samples), self.capacity - position)
+        self.__buffer[position:position + first] = samples[:first]
+        self.__buffer[:len(samples) - first] = samples[first:]
+        self.end += len(samples)
+
+    def truncate(self, end: int) -> None:
+        """
+        Forgets the samples from end on, so that they are overwritten by the next write
+        :param end: Absolute index, at least self.start
+        """
+        assert self.start <= end <= self.end
+        self.end = end
+
+    def read(self, start: int, stop: int, out: np.ndarray = None) -> np.ndarray:
+        """
+        :param start: Absolute index of the first sample, at least self.start
+        :param stop: Absolute index behind the last sample, at most self.end
+        :param out: Preallocated array of at least stop - start samples to copy into, e.g. in a real-time callback
+        :return: A copy of the samples, the first stop - start samples of out if given
+        """
+        assert self.start <= start <= stop <= self.end
+        position: int = start % self.capacity
+        first: int = min(stop - start, self.capacity - position)
+        if out is None:
+            return np.concatenate((self.__buffer[position:position + first], self.__buffer[:stop - start - first]))
+
+        self.read_unchecked(start, out[:stop - start])
+        return out[:stop - start]
+
+    def read_unchecked(self, start: int, out: np.ndarray) -> None:
+        """
+        Fills out with the samples from start on, without checking them against end. For a reader on another thread
+        that has to clamp to its own copy of end, since a truncate may move end at any time meanwhile: samples behind the
+        new end are then those that were cut, or already those written after, but never an error.
+        :param start: Absolute index of the first sample
+        :param out: At most capacity samples
+        """
+        position: int = start % self.capacity
+        first: int = min(len(out), self.capacity - position)
+        out[:first] = self.__buffer[position:position + first]
+        out[first:] = self.__buffer[:len(out) - first]
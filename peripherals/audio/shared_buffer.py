@@ -0,0 +1,57 @@
+# External libs
+import numpy as np
+
+# General utilities
+from threading import Lock
+from typing import Any
+
+
+class SharedBuffer:
+    """
+    A reference counted sample buffer for copy-on-write sharing between audio objects and chunks.
+
+    Every object that looks at the array calls share() once and release() once it stops looking at it. Owners may only
+    write to the array in place while they are its only user, otherwise they have to copy it first. Views that were
+    handed out without being counted are marked by export(), the array is never written to in place after that.
+    """
+
+    array: np.ndarray = None
+
+    __users: int = None
+    __users_lock: Lock = None
+    __exported: bool = None
+
+    def __init__(self, array: np.ndarray):
+        self.array = array
+        self.__users = 0
+        self.__users_lock = Lock()
+        self.__exported = False
+
+    def share(self) -> Any:
+        with self.__users_lock:
+            self.__users += 1
+        return self
+
+    def release(self) -> None:
+        with self.__users_lock:
+            self.__users -= 1
+
+    def export(self) -> None:
+        """
+        Marks the array as looked at by someone who never releases it, e.g. the caller of Audio.nparray()
+        """
+        with self.__users_lock:
+            self.__exported = True
+
+    @property
+    def shared(self) -> bool:
+        with self.__users_lock:
+            return self.__users > 1
+
+    @property
+    def writable(self) -> bool:
+        """
+        :return: True if the single user of this buffer may write to it in place
+        """
+        with self.__users_lock:
+            return self.array.flags.writeable and self.__users <= 1 and not self.__exported
@@ -0,0 +1,112 @@
+# External libs
+import numpy as np
+
+# Internal libs
+from peripherals.audio.audio import Audio
+from peripherals.audio.statistics import Statistics
+
+from infra.log.loggable import Loggable
+
+
+class SpeechPreprocessor(Loggable):
+    """
+    Shrinks utterances before transcription, since transcription latency scales with the length of the audio:
+    Converts to 16 kHz mono int16, trims leading and trailing silence and shortens long pauses.
+
+    Speech is detected per frame by its RMS energy, with some padding around it so that quiet word onsets and endings
+    are kept. Everything is computed on whole arrays.
+    """
+
+    FRAME_RATE: int = 16000
+
+    saved_seconds: float = None
+    saved_bytes: int = None
+
+    __frame_length: float = None
+    __silence_threshold: float = None
+    __relative_silence_db: float = None
+    __padding: float = None
+    __max_pause: float = None
+
+    def __init__(self,
+                 frame_length: float = 0.02,
+                 silence_threshold: float = 200.0,
+                 relative_silence_db: float = 35.0,
+                 padding: float = 0.2,
+                 max_pause: float = 0.4):
+        """
+        :param frame_length: Length in seconds of the frames that are classified as speech or silence
+        :param silence_threshold: Frames below this RMS energy (in int16 units) are silence
+        :param relative_silence_db: Frames this many dB below the loudest frame are silence as well
+        :param padding: Seconds of silence that are kept before and after speech
+        :param max_pause: Pauses longer than this many seconds are shortened to it
+        """
+        super().__init__()
+        self.__frame_length = frame_length
+        self.__silence_threshold = silence_threshold
+        self.__relative_silence_db = relative_silence_db
+        self.__padding = padding
+        self.__max_pause = max_pause
+
+        self.saved_seconds = 0.0
+        self.saved_bytes = 0
+
+    def __call__(self, audio: Audio) -> Audio:
+        """
+        :param audio: An utterance in any format, it is not changed
+        :return: The shortened utterance as 16 kHz mono int16, which may be empty if there was no speech at all
+        """
+        res: Audio = audio.copy()
+        res.to_channels(1)
+        res.resample(self.FRAME_RATE)
+        res.to_format(2, False)
+
+        samples: np.ndarray = res.nparray()
+        frame_size: int = max(int(self.__frame_length * self.FRAME_RATE), 1)
+        statistics: Statistics = Statistics(samples, frame_size)
+        keep: np.ndarray = self.__frames_to_keep(statistics.root_mean_square_energy, frame_size)
+
+        res = Audio(chunks=samples[np.repeat(keep, statistics.sizes)],
+                    channels=1,
+                    frame_rate=self.FRAME_RATE,
+                    sample_width=2,
+                    chunk_size=audio.chunk_size)
+
+        saved_seconds: float = audio.seconds() - res.seconds()
+        saved_bytes: int = audio.frames() * audio.channels * audio.sample_width - len(res.nparray()) * 2
+        self.saved_seconds += saved_seconds
+        self.saved_bytes += saved_bytes
+        self._logger.debug(f"Shortened utterance from {audio.seconds():.2f}s to {res.seconds():.2f}s, "
+                           f"saving {saved_seconds:.2f}s and {saved_bytes} bytes")
+        return res
+
+    def __frames_to_keep(self, rms: np.ndarray, frame_size: int) -> np.ndarray:
+        if not len(rms):
+            return np.zeros(0, dtype=bool)
+
+        threshold: float = max(self.__silence_threshold, rms.max() * 10 ** (-self.__relative_silence_db / 20))
+        speech: np.ndarray = rms >= threshold
+        if not speech.any():
+            return speech
+
+        # Widen speech by the padding on both sides
+        padding_frames: int = round(self.__padding * self.FRAME_RATE / frame_size)
+        speech = np.convolve(speech, np.ones(2 * padding_frames + 1), mode="same") > 0
+
+        # Silent runs are [starts[i], stops[i])
+        edges: np.ndarray = np.diff(np.concatenate(([1], speech, [1])).astype(np.int8))
+        starts: np.ndarray = np.flatnonzero(edges == -1)
+        stops: np.ndarray = np.flatnonzero(edges == 1)
+
+        # Pauses keep half of the maximum pause at either end (including the padding), leading and trailing silence
+        # beyond the padding is removed completely
+        half_pause: int = max(round(self.__max_pause * self.FRAME_RATE / frame_size / 2) - padding_frames, 0)
+        at_edge: np.ndarray = (starts == 0) | (stops == len(speech))
+        remove_starts: np.ndarray = np.where(at_edge, starts, starts + half_pause)
+        remove_stops: np.ndarray = np.where(at_edge, stops, stops - half_pause)
+        valid: np.ndarray = remove_starts < remove_stops
+
+        marks: np.ndarray = np.zeros(len(speech) + 1, dtype=np.int32)
+        np.add.at(marks, remove_starts[valid], 1)
+        np.add.at(marks, remove_stops[valid], -1)
+        return np.cumsum(marks[:-1]) == 0
@@ -0,0 +1,67 @@
+# External libs
+import numpy as np
+
+# General utilities
+from typing import Any
+
+
+class Statistics:
+    """
+    Signal statistics of consecutive sections of a sample array, e.g. the chunks of an audio object.
+
+    Every attribute holds one value per section. Everything is computed with numpy reductions, so the cost is a few
+    passes over the samples no matter how many sections there are. Values are in the units of the samples, i.e. an
+    int16 and a float32 signal are not comparable.
+    """
+
+    sizes: np.ndarray = None
+    mean_square_energy: np.ndarray = None
+    peak: np.ndarray = None
+    dc_offset: np.ndarray = None
+    zero_crossing_rate: np.ndarray = None
+
+    def __init__(self, samples: np.ndarray, section_size: int = None, channels: int = 1):
+        """
+        :param samples: Interleaved samples
+        :param section_size: Number of samples per section, the last section may be shorter. Defaults to one section.
+        :param channels: Number of interleaved channels - zero crossings are only counted within a channel
+        """
+        if not len(samples):
+            self.sizes = np.zeros(0, dtype=np.int64)
+            self.mean_square_energy = self.peak = self.dc_offset = self.zero_crossing_rate = np.zeros(0)
+            return
+
+        starts: np.ndarray = np.arange(0, len(samples), section_size or len(samples))
+        self.sizes = np.diff(starts, append=len(samples))
+
+        values: np.ndarray = samples.astype(np.float64)
+        self.dc_offset = np.add.reduceat(values, starts) / self.sizes
+        self.peak = np.maximum.reduceat(np.abs(values), starts)
+        values *= values
+        self.mean_square_energy = np.add.reduceat(values, starts) / self.sizes
+
+        # crossings[i] is True if sample i has a different sign than the previous sample of its channel
+        crossings: np.ndarray = np.zeros(len(samples), dtype=np.int32)
+        signs: np.ndarray = np.signbit(samples)
+        np.not_equal(signs[channels:], signs[:-channels], out=crossings[channels:], casting="unsafe")
+        self.zero_crossing_rate = np.add.reduceat(crossings, starts) / self.sizes
+
+    @property
+    def root_mean_square_energy(self) -> np.ndarray:
+        return np.sqrt(self.mean_square_energy)
+
+    def __weighted_mean(self, values: np.ndarray) -> float:
+        total: int = int(self.sizes.sum())
+        return float(np.dot(values, self.sizes) / total) if total else 0.0
+
+    def total(self) -> Any:
+        """
+        :return: The statistics of all sections taken together, as a Statistics object with a single section
+        """
+        res: Statistics = Statistics(np.zeros(0))
+        res.sizes = np.array([self.sizes.sum()])
+        res.mean_square_energy = np.array([self.__weighted_mean(self.mean_square_energy)])
+        res.peak = np.array([self.peak.max(initial=0.0)])
+        res.dc_offset = np.array([self.__weighted_mean(self.dc_offset)])
+        res.zero_crossing_rate = np.array([self.__weighted_mean(self.zero_crossing_rate)])
+        return res
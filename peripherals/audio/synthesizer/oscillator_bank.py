@@ -0,0 +1,85 @@
+# External libs
+import numpy as np
+
+# Internal libs
+from peripherals.audio.conversion import Conversion
+
+
+class OscillatorBank:
+    """
+    Renders the weighted sum of any number of sine partials as one matrix operation.
+
+    The phases of all partials are computed as an outer product of frequencies and sample indices (in double precision,
+    reduced to one cycle), turned into sines in the working format, and summed with one matrix-vector product. Long
+    signals are rendered in blocks to bound the size of the matrix.
+    Optionally, the sines are looked up in a linearly interpolated wavetable instead of calling np.sin.
+    """
+
+    BLOCK_SIZE: int = 4096
+
+    rate: int = None
+
+    __wavetable: np.ndarray = None
+    __wavetable_slopes: np.ndarray = None
+
+    def __init__(self, rate: int, wavetable_size: int = None):
+        """
+        :param rate: Frame rate
+        :param wavetable_size: Number of samples of one sine period in the wavetable, None to use np.sin
+        """
+        self.rate = rate
+        if wavetable_size:
+            # The slope to the next entry is stored per entry, so interpolating the last one needs no wrap-around
+            wavetable: np.ndarray = np.sin(np.arange(wavetable_size + 1) * (2 * np.pi / wavetable_size))
+            self.__wavetable = wavetable[:-1].astype(Conversion.working_d_type())
+            self.__wavetable_slopes = np.diff(wavetable).astype(Conversion.working_d_type())
+
+    def __oscillate(self, phase: np.ndarray, scratch: np.ndarray, out: np.ndarray) -> None:
+        """
+        Writes the sine of every phase to out. Phase and scratch are overwritten.
+        :param phase: Phases in cycles, in [0, 1)
+        """
+        if self.__wavetable is None:
+            np.multiply(phase, 2 * np.pi, out=out, casting="unsafe")
+            np.sin(out, out=out)
+            return
+
+        phase *= len(self.__wavetable)
+        np.floor(phase, out=scratch)
+        phase -= scratch
+        index: np.ndarray = scratch.astype(np.intp)
+        np.take(self.__wavetable, index, out=out)
+        slopes: np.ndarray = np.take(self.__wavetable_slopes, index)
+        np.multiply(slopes, phase, out=slopes, casting="unsafe")
+        out += slopes
+
+    def render(self, frequencies: np.ndarray | list, gains: np.ndarray | list, frames: int,
+               start: int = 0) -> np.ndarray:
+        """
+        :param frequencies: Frequency of every partial
+        :param gains: Factor of every partial
+        :param frames: Number of frames to render
+        :param start: Index of the first frame, so that consecutive blocks of a stream continue the phase
+        :return: The sum of all partials in the working format
+        """
+        d_type: np.dtype = Conversion.working_d_type()
+        cycles_per_frame: np.ndarray = np.asarray(frequencies, dtype=np.float64)[:, np.newaxis] / self.rate
+        gains = np.asarray(gains, dtype=d_type)
+        assert len(gains) == len(cycles_per_frame)
+
+        # Block sized buffers that are reused, so that the matrices stay in the cache
+        block_size: int = max(min(self.BLOCK_SIZE, frames), 1)
+        indices: np.ndarray = np.arange(block_size, dtype=np.float64)
+        phase: np.ndarray = np.empty((len(gains), block_size), dtype=np.float64)
+        scratch: np.ndarray = np.empty_like(phase)
+        samples: np.ndarray = np.empty(phase.shape, dtype=d_type)
+
+        res: np.ndarray = np.empty(frames, dtype=d_type)
+        for block_start in range(0, frames, block_size):
+            size: int = min(block_size, frames - block_start)
+            np.multiply(indices[:size] + (start + block_start), cycles_per_frame, out=phase[:, :size])
+            np.floor(phase[:, :size], out=scratch[:, :size])
+            phase[:, :size] -= scratch[:, :size]
+            self.__oscillate(phase[:, :size], scratch[:, :size], samples[:, :size])
+            np.dot(gains, samples[:, :size], out=res[block_start:block_start + size])
+        return res
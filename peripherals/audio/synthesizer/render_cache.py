@@ -0,0 +1,122 @@
+# External libs
+import numpy as np
+
+# Internal libs
+from peripherals.audio.audio import Audio
+
+from infra.log.loggable import Loggable
+
+# General utilities
+from collections import OrderedDict
+from hashlib import sha256
+from os import makedirs, replace
+from os.path import join, dirname, pardir, realpath, isfile
+from threading import Lock
+from typing import Callable, Any
+
+
+class RenderCache(Loggable):
+    """
+    A content-addressed cache for rendered sounds, keyed by everything the rendering depends on.
+
+    The first tier keeps recently used audio in memory, the second one stores the samples on disk as .npy files (raw
+    samples behind a small header), which are memory-mapped when loaded. Returned audio shares the cached samples
+    copy-on-write, so callers may modify it.
+    """
+
+    # Bump whenever rendering changes, so that stale files on disk are not used anymore
+    VERSION: int = 1
+    DEFAULT_DIRECTORY: str = realpath(join(dirname(__file__), pardir, pardir, pardir, "files", "cache", "renders"))
+
+    directory: str | None = None
+    capacity: int = None
+
+    __entries: OrderedDict[str, Audio] = None
+    __entries_lock: Lock = None
+
+    def __init__(self, directory: str | None = DEFAULT_DIRECTORY, capacity: int = 64):
+        """
+        :param directory: Where rendered samples are stored, None for a memory-only cache
+        :param capacity: Number of sounds that are kept in memory
+        """
+        super().__init__()
+        self.directory = directory
+        self.capacity = capacity
+        self.__entries = OrderedDict()
+        self.__entries_lock = Lock()
+
+    @staticmethod
+    def key(*parameters: Any) -> str:
+        """
+        :param parameters: Everything the rendering depends on, with a stable repr
+        """
+        return sha256(repr((RenderCache.VERSION,) + parameters).encode()).hexdigest()
+
+    def __path(self, key: str) -> str:
+        return join(self.directory, f"{key}.npy")
+
+    def __remember(self, key: str, audio: Audio) -> None:
+        with self.__entries_lock:
+            self.__entries[key] = audio
+            self.__entries.move_to_end(key)
+            while len(self.__entries) > self.capacity:
+                self.__entries.popitem(last=False)
+
+    def __load(self, key: str, frame_rate: int) -> Audio | None:
+        if self.directory is None or not isfile(self.__path(key)):
+            return None
+
+        try:
+            samples: np.ndarray = np.load(self.__path(key), mmap_mode="r")
+        except (OSError, ValueError):
+            self._logger.warning(f"Ignoring unreadable render cache file '{self.__path(key)}'")
+            return None
+
+        return Audio(chunks=samples.reshape(-1),
+                     channels=samples.shape[1],
+                     frame_rate=frame_rate,
+                     sample_width=samples.dtype.itemsize,
+                     chunk_size=Audio.DEFAULT_CHUNK_SIZE)
+
+    def __store(self, key: str, audio: Audio) -> None:
+        if self.directory is None:
+            return
+
+        try:
+            makedirs(self.directory, exist_ok=True)
+            # Written under a temporary name first, so that other processes never map a half-written file
+            temporary_path: str = f"{self.__path(key)}.{id(audio)}.tmp"
+            with open(temporary_path, "wb") as fh:
+                np.save(fh, audio.nparray().reshape(-1, audio.channels))
+            replace(temporary_path, self.__path(key))
+        except OSError:
+            self._logger.exception(f"Could not store '{key}' in the render cache")
+
+    def get_or_render(self, frame_rate: int, render: Callable[[], Audio], *parameters: Any) -> Audio:
+        """
+        :param frame_rate: Frame rate of the rendered audio
+        :param render: Renders the sound if it is not cached yet
+        :param parameters: Everything the rendering depends on, including the frame rate
+        :return: The sound, sharing its samples with the cache
+        """
+        key: str = self.key(*parameters)
+        with self.__entries_lock:
+            audio: Audio | None = self.__entries.get(key)
+            if audio is not None:
+                self.__entries.move_to_end(key)
+                return audio.copy()
+
+        audio = self.__load(key, frame_rate)
+        if audio is None:
+            audio = render()
+            audio.normalise_chunks(Audio.DEFAULT_CHUNK_SIZE)
+            self.__store(key, audio)
+        self.__remember(key, audio)
+        return audio.copy()
+
+    def clear(self) -> None:
+        """
+        Forgets the sounds in memory, the files on disk are kept
+        """
+        with self.__entries_lock:
+            self.__entries.clear()
@@ -0,0 +1,105 @@
+# External libs
+import numpy as np
+
+# Internal libs
+from peripherals.audio.audio import Audio
+from peripherals.audio.audio_stream import AudioStream
+from peripherals.audio.conversion import Conversion
+from peripherals.audio.synthesizer.note import Note
+from peripherals.audio.synthesizer.shape import Shape
+from peripherals.audio.synthesizer.synthesizer import Synthesizer
+
+# General utilities
+from heapq import heappush, heappop
+from itertools import count
+from threading import Lock
+from typing import List, Dict, Tuple, Callable, Iterator
+
+
+class Sequencer:
+    """
+    Plays timed note and chord events as one stream, rendering each event only when the playback cursor reaches it.
+
+    The stream is produced block by block: events that start within the next block are rendered, and all active events
+    are mixed into the block at their exact frame offsets. Finished events are dropped, so memory only depends on the
+    events that currently sound, not on the length of the song. Events can be added while the stream is playing.
+    """
+
+    synthesizer: Synthesizer = None
+
+    # Heap of (start frame, insertion number, render function)
+    __events: List[Tuple[int, int, Callable[[], Audio]]] = None
+    __events_lock: Lock = None
+    __insertion_numbers: Iterator[int] = None
+
+    def __init__(self, synthesizer: Synthesizer = None):
+        self.synthesizer = synthesizer or Synthesizer()
+        self.__events = []
+        self.__events_lock = Lock()
+        self.__insertion_numbers = count()
+
+    def add(self, time: float, render: Callable[[], Audio]) -> None:
+        """
+        :param time: Start of the event in seconds after the start of the stream
+        :param render: Renders the event once it is due, as mono audio at the frame rate of the synthesizer
+        """
+        assert time >= 0.0
+        with self.__events_lock:
+            heappush(self.__events, (round(time * self.synthesizer.rate), next(self.__insertion_numbers), render))
+
+    def note(self, time: float, note: Note, length: float,
+             tone_shape: Dict[float, float] = None,
+             harmonics: List[float] = None,
+             weights: List[float] = None) -> None:
+        tone_shape = tone_shape or Shape.SHARP_START
+        harmonics = self.synthesizer.CLEAN_HARMONICS if harmonics is None else harmonics
+        self.add(time, lambda: self.synthesizer.pluck(note, tone_shape, harmonics, weights, length))
+
+    def chord(self, time: float, note: Note, length: float,
+              is_major: bool = True,
+              tone_shape: Dict[float, float] = None,
+              harmonics: List[float] = None,
+              weights: List[float] = None) -> None:
+        self.add(time, lambda: self.synthesizer.chord(note, is_major, tone_shape, harmonics, weights, length))
+
+    def __render(self, render: Callable[[], Audio]) -> np.ndarray:
+        audio: Audio = render()
+        assert audio.channels == 1 and audio.frame_rate == self.synthesizer.rate
+        audio.to_working_format()
+        return audio.nparray()
+
+    def stream(self, block_size: int = Audio.DEFAULT_CHUNK_SIZE) -> AudioStream:
+        """
+        :return: A mono stream in the working format that ends once all events have been played
+        """
+
+        def blocks() -> Iterator[np.ndarray]:
+            cursor: int = 0
+            # (start frame, samples) of the events that currently sound
+            active: List[Tuple[int, np.ndarray]] = []
+            while True:
+                stop: int = cursor + block_size
+                with self.__events_lock:
+                    due: List[Tuple[int, Callable[[], Audio]]] = []
+                    while self.__events and self.__events[0][0] < stop:
+                        start, _, render = heappop(self.__events)
+                        due.append((start, render))
+                    pending: bool = bool(self.__events)
+
+                # Events that were added too late start right away
+                active += [(max(start, cursor), self.__render(render)) for start, render in due]
+                if not active and not pending:
+                    return
+
+                block: np.ndarray = np.zeros(block_size, dtype=Conversion.working_d_type())
+                for start, samples in active:
+                    first: int = max(cursor - start, 0)
+                    last: int = min(stop - start, len(samples))
+                    if last > first:
+                        block[start + first - cursor:start + last - cursor] += samples[first:last]
+                active = [(start, samples) for start, samples in active if start + len(samples) > stop]
+
+                yield block
+                cursor = stop
+
+        return AudioStream(blocks(), 1, self.synthesizer.rate, Conversion.WORKING_SAMPLE_WIDTH, True)
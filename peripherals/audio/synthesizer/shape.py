@@ -3,16 +3,22 @@ from scipy import interpolate as scipy_interpolate
 import numpy as np
 
 # Internal libs
-from peripherals.audio.audio import Audio, Chunk
+from peripherals.audio.audio import Audio
+from peripherals.audio.conversion import Conversion
 
 # General other
-from math import ceil
-from typing import List, Dict, Any, Callable
+from collections import OrderedDict
+from threading import Lock
+from typing import List, Dict, Tuple, Any, Callable
 
 
 class Shape:
     """
     Applies a shape to audio objects
+
+    The shape is rendered as one envelope over the whole signal and multiplied onto the samples in place. Rendered
+    envelopes are kept in an LRU cache shared by all shapes, so applying the same shape to audio of the same length
+    again costs just the multiplication.
     """
 
     # Shape examples
@@ -21,10 +27,20 @@ class Shape:
     FLAT_SHAPE = {0.0: 1.0, 1.0: 1.0}
     EXPONENTIAL_DECAY = {(x/20.0): pow(2.71, -x*x/5.0) for x in range(21)}
 
+    # Kinds that np.interp can render directly
+    LINEAR_KINDS = ("linear", "slinear")
+
+    # Envelope cache, keyed by (shape, length, rate, stretch, d_type)
+    CACHE_SIZE: int = 32
+    __cache: OrderedDict[Tuple, np.ndarray] = OrderedDict()
+    __cache_lock: Lock = Lock()
+
+    __key: Tuple = None
+
     # interpolator mode variables
+    __keys: np.ndarray = None
+    __vals: np.ndarray = None
     __scipy_interpolator: scipy_interpolate = None
-    __min_interpolator_x: float = None
-    __max_interpolator_x: float = None
 
     # function mode variables
     __fun: Callable = None
@@ -36,8 +52,9 @@ class Shape:
                  length: float = None):
 
         if callable(y_or_xy_values_or_function):
-            self.__fun = np.vectorize(y_or_xy_values_or_function)
+            self.__fun = y_or_xy_values_or_function
             self.__max_fun_mode_x = length
+            self.__key = ("function", y_or_xy_values_or_function, length)
         else:
             if isinstance(y_or_xy_values_or_function, list):
                 keys = [i/len(y_or_xy_values_or_function) for i in range(len(y_or_xy_values_or_function))]
@@ -49,59 +66,77 @@ class Shape:
                 max_x = max(keys)
                 keys = [key * length / max_x for key in keys]
 
-            self.__scipy_interpolator = scipy_interpolate.interp1d(keys, vals, kind=kind)
-            self.__min_interpolator_x = min(keys)
-            self.__max_interpolator_x = max(keys)
-
-    def apply(self, obj: Audio, stretch: bool = False) -> Audio:
-        if not obj.chunks:
-            return Audio([], sample_width=obj.sample_width, frame_rate=obj.frame_rate, channels=obj.channels)
-
-        chunk_size: int = obj.chunks[0].frames()
-        obj.normalise_chunks(chunk_size)
-
-        total_frames: int = obj.frames()
-        frame_rate: int = obj.frame_rate
-
-        shape_chunks: List[Chunk] = []
-        for i_chunk in range(ceil(total_frames / chunk_size)):
-            # array of actual times:
-            nparray: np.ndarray = (np.arange(chunk_size) + i_chunk * chunk_size) / frame_rate
-
-            # stretching the shape is equivalent to compressing the space to shape-size
-            factor: float = (self.__max_fun_mode_x or 1.0) / obj.seconds()
-            if stretch:
-                nparray *= factor
-
-            # chunks outside the shape area are just zeros
-            upper_cut_off: float = self.__max_fun_mode_x or self.__max_interpolator_x
-            lower_cut_off: float = self.__min_interpolator_x
-            if upper_cut_off and (nparray[0] > upper_cut_off or nparray[-1] < lower_cut_off):
-                shape_chunks.append(Chunk.zeros(chunk_size, obj.sample_width, obj.using_float))
-                continue
-
-            # actual application
-            min_index: int = np.searchsorted(nparray, lower_cut_off)
-            max_index: int = np.searchsorted(nparray, upper_cut_off)
-
-            front: np.ndarray
-            mid: np.ndarray
-            tail: np.ndarray
-            front, mid, tail = np.split(nparray, [min_index, max_index])
-            front.fill(0.0)
-            tail.fill(0.0)
-            if self.__fun:
-                mid = self.__fun(mid)
+            self.__keys = np.array(keys, dtype=np.float64)
+            self.__vals = np.array(vals, dtype=np.float64)
+            if kind not in self.LINEAR_KINDS:
+                self.__scipy_interpolator = scipy_interpolate.interp1d(keys, vals, kind=kind)
+            self.__key = ("points", tuple(keys), tuple(vals), kind)
+
+    def __evaluate_function(self, times: np.ndarray) -> np.ndarray:
+        """
+        Calls the function on the whole array, and only falls back to calling it per value if it cannot handle arrays
+        """
+        try:
+            values: np.ndarray = np.asarray(self.__fun(times), dtype=np.float64)
+            if values.shape == times.shape:
+                return values
+        except (TypeError, ValueError):
+            pass
+        return np.vectorize(self.__fun, otypes=[np.float64])(times)
+
+    def __render(self, frames: int, frame_rate: int, stretch: bool) -> np.ndarray:
+        """
+        :return: The envelope value of every frame in the working format, zero outside the shape area
+        """
+        # Stretching the shape is equivalent to compressing the time to shape-size
+        times: np.ndarray = np.arange(frames, dtype=np.float64)
+        times *= (self.__max_fun_mode_x or 1.0) / frames if stretch else 1.0 / frame_rate
+
+        if self.__fun is not None:
+            if self.__max_fun_mode_x is None:
+                values: np.ndarray = self.__evaluate_function(times)
             else:
-                mid = self.__scipy_interpolator(mid)
-            nparray = np.concatenate((front, mid, tail), None)
-            shape_chunks.append(Chunk(nparray=nparray))
-
-        shape_obj: Audio = Audio(shape_chunks,
-                                 channels=obj.channels,
-                                 frame_rate=frame_rate,
-                                 sample_width=obj.sample_width)
-
-        shape_obj *= obj
+                values: np.ndarray = np.zeros(frames, dtype=np.float64)
+                inside: int = int(np.searchsorted(times, self.__max_fun_mode_x, side="right"))
+                values[:inside] = self.__evaluate_function(times[:inside])
+        elif self.__scipy_interpolator is None:
+            values: np.ndarray = np.interp(times, self.__keys, self.__vals, left=0.0, right=0.0)
+        else:
+            values: np.ndarray = np.zeros(frames, dtype=np.float64)
+            start: int = int(np.searchsorted(times, self.__keys[0], side="left"))
+            stop: int = int(np.searchsorted(times, self.__keys[-1], side="right"))
+            values[start:stop] = self.__scipy_interpolator(times[start:stop])
+
+        envelope: np.ndarray = values.astype(Conversion.working_d_type())
+        envelope.setflags(write=False)
+        return envelope
+
+    def envelope(self, frames: int, frame_rate: int, stretch: bool = False) -> np.ndarray:
+        """
+        :return: The read-only envelope for audio of this length, from the cache if possible
+        """
+        key: Tuple = (self.__key, frames, frame_rate, stretch, Conversion.WORKING_SAMPLE_WIDTH)
+        with self.__cache_lock:
+            envelope: np.ndarray | None = self.__cache.get(key)
+            if envelope is not None:
+                self.__cache.move_to_end(key)
+                return envelope
+
+        envelope = self.__render(frames, frame_rate, stretch)
+        with self.__cache_lock:
+            self.__cache[key] = envelope
+            while len(self.__cache) > self.CACHE_SIZE:
+                self.__cache.popitem(last=False)
+        return envelope
 
-        return shape_obj
+    def apply(self, obj: Audio, stretch: bool = False) -> Audio:
+        """
+        Multiplies the shape onto obj in place, converting it to the working format first if necessary
+        :return: obj
+        """
+        obj.to_working_format()
+        if not obj.frames():
+            return obj
+
+        obj *= self.envelope(obj.frames(), obj.frame_rate, stretch)
+        return obj
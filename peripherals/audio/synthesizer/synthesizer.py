@@ -1,11 +1,15 @@
 # Internal libs
 from peripherals.audio.synthesizer.scale import Scale, Note
 from peripherals.audio.audio import Audio
+from peripherals.audio.audio_stream import AudioStream
+from peripherals.audio.conversion import Conversion
 from peripherals.audio.synthesizer.shape import Shape
+from peripherals.audio.synthesizer.oscillator_bank import OscillatorBank
+from peripherals.audio.synthesizer.render_cache import RenderCache
 
 # General utilities
 import numpy as np
-from typing import List, Dict
+from typing import List, Dict, Tuple, Iterator
 
 
 class Synthesizer:
@@ -22,28 +26,64 @@ class Synthesizer:
     TWO_THIRDS = [2, 4]
     FULL_THIRDS = [2, 4, 6, 8]
 
-    def __init__(self, rate=DEFAULT_RATE, default_length=1.0):
+    oscillator_bank: OscillatorBank = None
+    render_cache: RenderCache = None
+
+    __wavetable_size: int = None
+
+    def __init__(self, rate=DEFAULT_RATE, default_length=1.0, wavetable_size: int = None,
+                 render_cache: RenderCache = None):
+        """
+        :param wavetable_size: If given, sines are looked up in a wavetable of this size instead of calling np.sin
+        :param render_cache: If given, chords are only rendered once and then taken from this cache
+        """
         self.rate = rate
         self.default_length = default_length
+        self.oscillator_bank = OscillatorBank(rate, wavetable_size)
+        self.render_cache = render_cache
+        self.__wavetable_size = wavetable_size
 
-    def sine(self, frequency, length=None) -> Audio:
-        signal_size = int((self.default_length if length is None else length) * self.rate)
-        factor = float(frequency) * (np.pi * 2) / self.rate
-        return Audio(np.sin(np.arange(signal_size) * factor))
+    def __frames(self, length) -> int:
+        return int((self.default_length if length is None else length) * self.rate)
 
-    # Gives bytes for the requested frequency plus harmonic overtones
-    def harmonics(self, freq: float, harmonics: List[float], weights: List[float],  length: int = None) -> Audio:
+    def __render(self, frequencies: np.ndarray, gains: np.ndarray, length) -> Audio:
+        return Audio(self.oscillator_bank.render(frequencies, gains, self.__frames(length)), frame_rate=self.rate)
 
+    def sine(self, frequency, length=None) -> Audio:
+        return self.__render(np.array([frequency]), np.array([1.0]), length)
+
+    def sine_stream(self, frequency, length=None, chunk_size: int = Audio.DEFAULT_CHUNK_SIZE) -> AudioStream:
+        """
+        Streaming version of sine that renders one chunk at a time
+        :param length: Length in seconds, or None for an endless tone
+        """
+        signal_size: int | None = None if length is None else int(length * self.rate)
+
+        def chunks() -> Iterator[np.ndarray]:
+            start: int = 0
+            while signal_size is None or start < signal_size:
+                stop: int = start + chunk_size if signal_size is None else min(start + chunk_size, signal_size)
+                yield self.oscillator_bank.render([frequency], [1.0], stop - start, start)
+                start = stop
+
+        return AudioStream(chunks(), Audio.DEFAULT_CHANNELS, self.rate, Conversion.WORKING_SAMPLE_WIDTH, True)
+
+    @staticmethod
+    def __partials(freq: float, harmonics: List[float], weights: List[float]) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        :return: Frequencies and gains of the fundamental and its overtones, the gains add up to 1
+        """
         if weights is None:
             weights = [1/(h*h) for h in harmonics]
 
         assert(len(harmonics) == len(weights))
 
-        wave: Audio = self.sine(freq, length)
-        for harmonic, weight in zip(harmonics, weights):
-            wave += self.sine(freq * harmonic, length) * weight
+        gains: np.ndarray = np.array([1.0] + weights)
+        return freq * np.array([1.0] + harmonics), gains / gains.sum()
 
-        return wave / (sum(weights) + 1.0)
+    # Gives bytes for the requested frequency plus harmonic overtones
+    def harmonics(self, freq: float, harmonics: List[float], weights: List[float],  length: int = None) -> Audio:
+        return self.__render(*self.__partials(freq, harmonics, weights), length)
 
     # Gives bytes for the requested frequency with overtones and volume shape
     def pluck(self, note: Note,
@@ -65,11 +105,30 @@ class Synthesizer:
                       length=None) -> Audio:
 
         chord_root: Note = chord_scale.get(n)
-        chord_chunk: Audio = self.pluck(chord_root, tone_shape, harmonics, weights, length)
-        for steps in scale_steps:
-            chord_chunk += self.pluck(chord_scale.transpose(chord_root, steps), tone_shape, harmonics, weights, length)
-
-        return chord_chunk * 0.3
+        notes: List[Note] = [chord_root] + [chord_scale.transpose(chord_root, steps) for steps in scale_steps]
+
+        note_frequencies: List[float] = [note.frequency() for note in notes]
+
+        def render() -> Audio:
+            # All notes share the tone shape, so the partials of all notes are rendered in one go and shaped once
+            partial_frequencies, partial_gains = self.__partials(1.0, harmonics, weights)
+            frequencies: np.ndarray = np.outer(note_frequencies, partial_frequencies)
+            gains: np.ndarray = np.outer([0.3] * len(notes), partial_gains)
+            chord_obj: Audio = self.__render(frequencies.reshape(-1), gains.reshape(-1), length)
+            return Shape(tone_shape, 'slinear').apply(chord_obj)
+
+        if self.render_cache is None:
+            return render()
+        return self.render_cache.get_or_render(self.rate, render,
+                                               "chord",
+                                               tuple(note_frequencies),
+                                               tuple(sorted(tone_shape.items())),
+                                               tuple(harmonics),
+                                               None if weights is None else tuple(weights),
+                                               self.__frames(length),
+                                               self.rate,
+                                               Conversion.WORKING_SAMPLE_WIDTH,
+                                               self.__wavetable_size)
 
     def chord(self,
               note: Note,
@@ -94,27 +153,28 @@ if __name__ == '__main__':
     LoggingSetup(override_level=LoggingSetup.DEBUG)
 
     from peripherals.audio.output import Output
-    from peripherals.audio.audio import Audio
+    from peripherals.audio.synthesizer.sequencer import Sequencer
 
-    sb = Synthesizer(default_length=0.5)
+    sb = Synthesizer(default_length=0.5, render_cache=RenderCache())
+    sequencer: Sequencer = Sequencer(sb)
     c_major = Scale(Note("C", 4), Scale.MAJOR)
 
-    def example_chord(key: int, length: float) -> Audio:
-        return sb.chord(c_major.get(key),
+    # (scale index, length) of every chord, they are rendered while the song is playing
+    song: List[Tuple[int, float]] = [(i, 0.5) for i in range(4)]
+    song += [(4, 1.0)] * 2
+    song += [(5, 0.5)] * 4
+    song += [(4, 2.0)]
+    song += [(3, 0.5)] * 4
+    song += [(2, 1.0)] * 2
+    song += [(4, 0.5)] * 4
+    song += [(0, 2.0)]
+
+    time: float = 0.0
+    for key, chord_length in song:
+        sequencer.chord(time, c_major.get(key), chord_length,
                         tone_shape=Shape.EXPONENTIAL_DECAY,
-                        harmonics=sb.NO_HARMONICS,
-                        length=length)
-
-    chords: List[Audio] = [example_chord(i, 0.5) for i in range(4)]
-    chords += [example_chord(4, 1.0)] * 2
-    chords += [example_chord(5, 0.5)] * 4
-    chords += [example_chord(4, 2.0)]
-    chords += [example_chord(3, 0.5)] * 4
-    chords += [example_chord(2, 1.0)] * 2
-    chords += [example_chord(4, 0.5)] * 4
-    chords += [example_chord(0, 2.0)]
-
-    output: Output = Output()
-    for audio in chords:
-        output.play(audio)
-    output.close()
+                        harmonics=sb.NO_HARMONICS)
+        time += chord_length
+
+    with Output() as output:
+        output.play(sequencer.stream()).wait()
@@ -5,39 +5,75 @@ from peripherals.audio.output import Output
 from infra.resources_management.threaded_app import ThreadedApp
 
 # General utilities
+from threading import Condition
 from time import sleep
 from typing import List
 
 
 class Timing(ThreadedApp):
+    """
+    Half-duplex coordination: the microphones are switched off while any output is playing, and back on once all
+    outputs are done. Reacts to the activity events of the outputs instead of polling, and only waits for a short
+    guard interval between switching one side off and the other one on, so that the speaker is not recorded.
+    """
 
     output_apps: List[Output]
     input_apps: List[Input]
+    guard_interval: float = None
 
-    def __init__(self, input_apps: List[Input], output_apps: List[Output]):
+    __state_changed: Condition = None
+
+    def __init__(self, input_apps: List[Input], output_apps: List[Output], guard_interval: float = 0.15):
+        """
+        :param guard_interval: Seconds between switching the microphones off and playback on, and vice versa
+        """
         super().__init__()
         self.input_apps = input_apps
         self.output_apps = output_apps
+        self.guard_interval = guard_interval
+        self.__state_changed = Condition()
+
+        for app in self.output_apps:
+            app.activity.subscribe(lambda _: self.__notify())
 
         self._make_thread(self.__time_audio_inout)
 
+    def __notify(self) -> None:
+        with self.__state_changed:
+            self.__state_changed.notify_all()
+
+    def __speaking(self) -> bool:
+        return any(app.active() for app in self.output_apps)
+
     def __time_audio_inout(self):
-        while not self.was_closed:
-            if any(app.active() for app in self.output_apps):
+        speaking: bool | None = None
+        while True:
+            with self.__state_changed:
+                self.__state_changed.wait_for(lambda: self.was_closed or self.__speaking() != speaking)
+            if self.was_closed:
+                break
+
+            speaking = self.__speaking()
+            if speaking:
                 self._logger.debug("Active App detected")
                 for app in self.input_apps:
                     app.stop_recording()
-                sleep(1.0)
+                self._was_closed.wait(self.guard_interval)
                 for app in self.output_apps:
                     app.start_playing()
             else:
                 self._logger.debug("No Active App detected")
                 for app in self.output_apps:
                     app.stop_playing()
-                sleep(1.0)
+                self._was_closed.wait(self.guard_interval)
                 for app in self.input_apps:
                     app.start_recording()
-            sleep(1.0)
+
+    def close(self) -> None:
+        # Wakes up the timing thread, before super().close() joins it
+        self._was_closed.set()
+        self.__notify()
+        super().close()
 
 
 if __name__ == '__main__':
@@ -53,4 +89,5 @@ if __name__ == '__main__':
                     record: Audio
                     _, record = inp.queue.get()
                     output.play(record)
-                    sleep(1.0)
+                    output.activity.wait_for(False)
+                    sleep(timing.guard_interval)
@@ -0,0 +1,78 @@
+# External libs
+import numpy as np
+
+# Internal libs
+from peripherals.audio.statistics import Statistics
+
+
+class VoiceActivityDetector:
+    """
+    Frame-level voice activity detection by energy and zero-crossing rate, with hangover.
+
+    A frame counts as speech if its RMS energy is above the threshold, unless it crosses zero so often that it is more
+    likely broadband noise (e.g. a fan or the white noise generator) - very loud frames count as speech regardless.
+    Every frame within the hangover after a speech frame is active as well, so short pauses between words do not end
+    an utterance. Blocks of whole frames are processed at once, the hangover carries over from block to block.
+    """
+
+    frame_size: int = None
+
+    __energy_threshold: float = None
+    __noise_zero_crossing_rate: float = None
+    __loud_factor: float = None
+    __hangover_frames: int = None
+
+    # Number of frames since the last speech frame, at the end of the last block
+    __frames_since_speech: int = None
+
+    def __init__(self, frame_rate: int,
+                 frame_length: float = 0.02,
+                 energy_threshold: float = 200.0,
+                 noise_zero_crossing_rate: float = 0.35,
+                 loud_factor: float = 4.0,
+                 hangover: float = 0.5):
+        """
+        :param frame_rate: Frame rate of the mono samples
+        :param frame_length: Length of a frame in seconds
+        :param energy_threshold: Minimum RMS energy of speech frames, in int16 units
+        :param noise_zero_crossing_rate: Frames with a higher zero-crossing rate are noise...
+        :param loud_factor: ...unless they are this many times louder than the energy threshold
+        :param hangover: Seconds that stay active after the last speech frame, i.e. the endpointing latency
+        """
+        self.frame_size = max(int(frame_length * frame_rate), 1)
+        self.__energy_threshold = energy_threshold
+        self.__noise_zero_crossing_rate = noise_zero_crossing_rate
+        self.__loud_factor = loud_factor
+        self.__hangover_frames = round(hangover * frame_rate / self.frame_size)
+        self.reset()
+
+    def reset(self) -> None:
+        self.__frames_since_speech = self.__hangover_frames + 1
+
+    def speech(self, samples: np.ndarray) -> np.ndarray:
+        """
+        :param samples: Mono int16 samples, a whole number of frames
+        :return: Whether each frame contains speech, without hangover
+        """
+        statistics: Statistics = Statistics(samples, self.frame_size)
+        rms: np.ndarray = statistics.root_mean_square_energy
+        return (rms >= self.__energy_threshold) & ((statistics.zero_crossing_rate <= self.__noise_zero_crossing_rate) |
+                                                  (rms >= self.__energy_threshold * self.__loud_factor))
+
+    def detect(self, samples: np.ndarray) -> np.ndarray:
+        """
+        :param samples: Mono int16 samples, a whole number of frames
+        :return: Whether each frame is active, i.e. speech or within the hangover after speech
+        """
+        assert len(samples) % self.frame_size == 0
+        speech: np.ndarray = self.speech(samples)
+
+        # Index of the last speech frame at or before every frame, relative to the start of the block
+        indices: np.ndarray = np.arange(len(speech))
+        last_speech: np.ndarray = np.where(speech, indices, -self.__frames_since_speech)
+        np.maximum.accumulate(last_speech, out=last_speech)
+
+        frames_since_speech: np.ndarray = indices - last_speech
+        if len(speech):
+            self.__frames_since_speech = min(int(frames_since_speech[-1]) + 1, self.__hangover_frames + 1)
+        return frames_since_speech <= self.__hangover_frames
@@ -0,0 +1,71 @@
+# External libs
+import numpy as np
+
+# General utilities
+from mmap import mmap, ACCESS_READ
+from struct import unpack_from
+
+
+class WavFile:
+    """
+    A memory-mapped, read-only view of the samples of a wav file.
+
+    The RIFF header is parsed once, the samples are exposed as a numpy array straight over the mapped file. Pages are
+    only read from disk when the samples are actually accessed, so opening even long files costs next to nothing.
+    The mapping stays alive for as long as the samples array (or any view of it) is referenced.
+    Already loaded wav bytes can be parsed the same way, without copying them.
+    """
+
+    PCM_FORMAT: int = 1
+    FLOAT_FORMAT: int = 3
+    EXTENSIBLE_FORMAT: int = 0xFFFE
+
+    channels: int = None
+    frame_rate: int = None
+    sample_width: int = None
+    using_float: bool = None
+
+    samples: np.ndarray = None
+
+    def __init__(self, filename: str = None, data: bytes = None):
+        if filename is not None:
+            with open(filename, "rb") as fh:
+                mapped: mmap | bytes = mmap(fh.fileno(), 0, access=ACCESS_READ)
+        else:
+            mapped: mmap | bytes = data
+            filename = "<buffer>"
+
+        assert mapped[0:4] == b"RIFF" and mapped[8:12] == b"WAVE", f"'{filename}' is not a wav file"
+
+        data_offset: int | None = None
+        data_size: int = 0
+        position: int = 12
+        while position + 8 <= len(mapped):
+            chunk_id: bytes = mapped[position:position + 4]
+            chunk_size: int = unpack_from("<I", mapped, position + 4)[0]
+            if chunk_id == b"fmt ":
+                self.__parse_format(mapped, position + 8)
+            elif chunk_id == b"data":
+                data_offset = position + 8
+                # Streamed files may not know their size, the data then just runs until the end of the file
+                data_size = min(chunk_size, len(mapped) - data_offset)
+                break
+            position += 8 + chunk_size + chunk_size % 2
+
+        assert self.sample_width is not None and data_offset is not None, f"'{filename}' is missing fmt or data"
+
+        d_type: np.dtype = np.dtype(f"<{'f' if self.using_float else 'i'}{self.sample_width}")
+        self.samples = np.frombuffer(mapped, dtype=d_type, count=data_size // d_type.itemsize, offset=data_offset)
+
+    def __parse_format(self, mapped: mmap | bytes, offset: int) -> None:
+        audio_format, self.channels, self.frame_rate = unpack_from("<HHI", mapped, offset)
+        bits_per_sample: int = unpack_from("<H", mapped, offset + 14)[0]
+        if audio_format == self.EXTENSIBLE_FORMAT:
+            # The actual format is the first two bytes of the sub format GUID
+            audio_format = unpack_from("<H", mapped, offset + 24)[0]
+
+        self.sample_width = bits_per_sample // 8
+        self.using_float = audio_format == self.FLOAT_FORMAT
+        assert (audio_format == self.PCM_FORMAT and self.sample_width == 2) or \
+               (audio_format == self.FLOAT_FORMAT and self.sample_width in (4, 8)), \
+               f"Unsupported wav format {audio_format} with {bits_per_sample} bits per sample"
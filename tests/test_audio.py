@@ -0,0 +1,43 @@
+# External libs
+import numpy as np
+
+# Internal libs
+from peripherals.audio.audio import Audio
+
+
+def ramp() -> Audio:
+    return Audio(np.arange(5, dtype=np.int16), channels=1, frame_rate=8000, sample_width=2)
+
+
+def test_audio_from_the_samples_of_another_does_not_change_with_it():
+    a: Audio = ramp()
+    b: Audio = Audio(a.nparray(), channels=1, frame_rate=8000, sample_width=2)
+    a *= 10
+
+    assert b.nparray().tolist() == [0, 1, 2, 3, 4]
+    assert a.nparray().tolist() == [0, 10, 20, 30, 40]
+
+
+def test_samples_handed_out_do_not_change_with_the_audio():
+    a: Audio = ramp()
+    samples: np.ndarray = a.nparray()
+    a *= 2
+    a += a
+
+    assert samples.tolist() == [0, 1, 2, 3, 4]
+    assert a.nparray().tolist() == [0, 4, 8, 12, 16]
+
+
+def test_audio_does_not_change_with_the_array_it_was_created_from():
+    samples: np.ndarray = np.arange(5, dtype=np.int16)
+    a: Audio = Audio(samples, channels=1, frame_rate=8000, sample_width=2)
+    samples[:] = 7
+
+    assert a.nparray().tolist() == [0, 1, 2, 3, 4]
+
+
+def test_immutable_samples_are_not_copied():
+    data: bytes = np.arange(5, dtype=np.int16).tobytes()
+    a: Audio = Audio(byte_chunks=[data], channels=1, frame_rate=8000, sample_width=2)
+
+    assert np.shares_memory(a.nparray(), np.frombuffer(data, dtype=np.int16))
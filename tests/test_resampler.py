@@ -0,0 +1,24 @@
+# External libs
+import numpy as np
+import pytest
+from scipy.signal import resample_poly
+
+# Internal libs
+from peripherals.audio.resampler import Resampler
+
+# General utilities
+from fractions import Fraction
+
+
+@pytest.mark.parametrize("from_rate, to_rate, channels", [(24000, 44100, 1), (44100, 16000, 2), (44100, 48000, 1)])
+def test_chunks_are_resampled_like_the_whole_signal(from_rate: int, to_rate: int, channels: int):
+    frames: np.ndarray = np.random.default_rng(0).uniform(-0.5, 0.5, (from_rate // 2, channels))
+    ratio: Fraction = Fraction(to_rate, from_rate)
+    expected: np.ndarray = resample_poly(frames, ratio.numerator, ratio.denominator, axis=0)
+
+    resampler: Resampler = Resampler(from_rate, to_rate, channels)
+    outputs = [resampler.process(frames[start:start + 1000]) for start in range(0, len(frames), 1000)]
+    res: np.ndarray = np.concatenate(outputs + [resampler.flush()])
+
+    assert res.shape == expected.shape
+    assert np.abs(res - expected).max() < 1e-9
@@ -0,0 +1,43 @@
+# External libs
+import numpy as np
+
+# Internal libs
+from peripherals.audio.audio import Audio
+from peripherals.audio.speech_preprocessor import SpeechPreprocessor
+
+
+FRAME_RATE: int = SpeechPreprocessor.FRAME_RATE
+
+
+def tone(seconds: float) -> np.ndarray:
+    return (8000 * np.sin(2 * np.pi * 440 * np.arange(round(seconds * FRAME_RATE)) / FRAME_RATE)).astype(np.int16)
+
+
+def silence(seconds: float) -> np.ndarray:
+    return np.zeros(round(seconds * FRAME_RATE), dtype=np.int16)
+
+
+def preprocess(*parts: np.ndarray) -> np.ndarray:
+    audio: Audio = Audio(np.concatenate(parts), channels=1, frame_rate=FRAME_RATE, sample_width=2)
+    return SpeechPreprocessor(padding=0.2, max_pause=1.0)(audio).nparray()
+
+
+def test_leading_and_trailing_silence_is_trimmed_to_the_padding():
+    samples: np.ndarray = preprocess(silence(1.0), tone(0.5), silence(1.0))
+    loud: np.ndarray = np.flatnonzero(samples)
+
+    assert abs(loud[0] / FRAME_RATE - 0.2) <= 0.02
+    assert abs((len(samples) - 1 - loud[-1]) / FRAME_RATE - 0.2) <= 0.02
+
+
+def test_long_pauses_are_shortened_to_the_maximum_pause():
+    samples: np.ndarray = preprocess(tone(0.5), silence(2.0), tone(0.5))
+    loud: np.ndarray = np.flatnonzero(samples)
+    gaps: np.ndarray = np.diff(loud)
+
+    assert abs((gaps.max() - 1) / FRAME_RATE - 1.0) <= 0.02
+    assert abs(len(samples) / FRAME_RATE - 2.0) <= 0.02
+
+
+def test_silence_only_is_removed_completely():
+    assert not len(preprocess(silence(1.0)))